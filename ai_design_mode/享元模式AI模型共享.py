@@ -1,9 +1,26 @@
 import time
 import sys
+import mmap
+import os
+import queue
+import tempfile
 from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from contextlib import contextmanager
 from dataclasses import dataclass
+import multiprocessing
 import threading
 
+# 模型基础权重的估算大小(MB)，未列出的模型按DEFAULT_MODEL_SIZE_MB计
+MODEL_SIZES_MB = {"ResNet50": 98, "BERT": 420}
+DEFAULT_MODEL_SIZE_MB = 100
+QUANTIZED_OVERHEAD = 0.02  # 量化变体额外的缩放表等占基础权重的比例
+BYTES_PER_SIMULATED_MB = 1024  # 演示中用1KB模拟1MB，避免真实占用大量内存
+CPU_WORK_PER_INPUT = 20000  # 每个输入模拟的纯Python计算量(持有GIL)
+LOAD_SECONDS_PER_MB = 0.001  # 首次生成权重文件(下载/解码)的模拟耗时
+WEIGHTS_DIR = os.path.join(tempfile.gettempdir(), "flyweight_weights")
+
 
 @dataclass(frozen=True)
 class ModelKey:
@@ -20,24 +37,223 @@ class AIModel(ABC):
     def predict(self, input_data):
         pass
 
+    def predict_many(self, inputs):
+        """批量预测，默认逐个调用predict"""
+        return [self.predict(input_data) for input_data in inputs]
+
+
+class MicroBatcher:
+    """微批处理前端：后台线程合并并发线程对同一享元的调用，凑成一批调用一次predict_many
+
+    一批执行期间到达的请求在下一批中一起处理，max_wait为凑批的额外等待时间。
+    close之后submit抛出RuntimeError(后台线程已退出，不会再处理新请求)。
+    """
+
+    def __init__(self, predict_many, max_batch_size=16, max_wait=0.002):
+        self._predict_many = predict_many
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._closed = False
+        self._close_lock = threading.Lock()  # 保证close之后不会再有请求入队
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        self.calls = 0
+        self.batches = 0
+
+    def submit(self, input_data):
+        """提交一个输入并阻塞等待其结果"""
+        future = Future()
+        with self._close_lock:
+            if self._closed:
+                raise RuntimeError("模型已卸载，微批处理已停止")
+            self._queue.put((input_data, future))
+        return future.result()
+
+    def _next_batch(self):
+        item = self._queue.get()
+        if item is None:
+            return None
+        batch = [item]
+        deadline = time.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            try:
+                item = self._queue.get(timeout=max(0.0, deadline - time.time()))
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)  # 先处理完已收集的批次再退出
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while (batch := self._next_batch()) is not None:
+            self.calls += len(batch)
+            self.batches += 1
+            try:
+                results = self._predict_many([input_data for input_data, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
+    def close(self):
+        """处理完已提交的请求后停止后台线程"""
+        with self._close_lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(None)
+        self._thread.join()
+
+
+class WeightsStore:
+    """权重文件仓库：每个模型版本的权重只生成一次写入文件，之后各进程、各变体只读mmap同一文件
+
+    只读映射的页面来自系统页缓存，多个进程映射同一文件时共享物理内存。
+    """
+
+    def __init__(self, root=WEIGHTS_DIR):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, model_name, model_version):
+        return os.path.join(self.root, f"{model_name}-{model_version}.weights")
+
+    def _materialize(self, path, size):
+        """生成权重文件，先写临时文件再原子替换，避免其他进程读到不完整的文件"""
+        time.sleep(size / BYTES_PER_SIMULATED_MB * LOAD_SECONDS_PER_MB)  # 模拟下载/解码
+        fd, tmp_path = tempfile.mkstemp(dir=self.root)
+        with os.fdopen(fd, "wb") as f:
+            f.write(bytes(i % 251 for i in range(size)))
+        os.replace(tmp_path, path)
+
+    def open(self, model_name, model_version, size):
+        """只读映射权重文件(不存在时先生成)"""
+        path = self.path(model_name, model_version)
+        if not os.path.exists(path) or os.path.getsize(path) != size:
+            self._materialize(path, size)
+        with open(path, "rb") as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def memory_report(self, model_name, model_version):
+        """本进程中该权重文件映射的常驻与共享内存(KB)，读取/proc/self/smaps，非Linux返回None"""
+        path = self.path(model_name, model_version)
+        report = {"rss_kb": 0, "pss_kb": 0, "shared_kb": 0, "private_kb": 0}
+        try:
+            with open("/proc/self/smaps") as f:
+                in_mapping = False
+                for line in f:
+                    fields = line.split()
+                    if "-" in fields[0] and not fields[0].endswith(":"):
+                        in_mapping = fields[-1] == path  # 映射区域的首行，末尾为文件路径
+                    elif in_mapping and fields[0] in ("Rss:", "Pss:"):
+                        report[fields[0][:-1].lower() + "_kb"] += int(fields[1])
+                    elif in_mapping and fields[0].startswith(("Shared_", "Private_")):
+                        report[fields[0].split("_")[0].lower() + "_kb"] += int(fields[1])
+        except OSError:
+            return None
+        return report
+
+
+weights_store = WeightsStore()
+
+
+class BaseWeights:
+    """同一模型同一版本的基础权重，全精度与量化变体共享同一块只读映射
+
+    各变体通过view取得映射的视图；close之后要等最后一个视图释放才真正解除映射。
+    """
+
+    def __init__(self, model_name, model_version, store=None):
+        self.model_name = model_name
+        self.model_version = model_version
+        self.size_mb = MODEL_SIZES_MB.get(model_name, DEFAULT_MODEL_SIZE_MB)
+        self.store = store or weights_store
+        start = time.time()
+        self.buffer = self.store.open(model_name, model_version, self.size_mb * BYTES_PER_SIMULATED_MB)
+        self.users = 0  # 引用该权重的已加载享元数(由ModelFactory在_lock内维护)
+        self._views = 0  # 尚未释放的视图数
+        self._closed = False
+        self._view_lock = threading.Lock()
+        print(f"📦 映射基础权重: {model_name}-{model_version} - 大小: {self.size_mb} MB, "
+              f"耗时 {time.time() - start:.3f}s")
+
+    def memory_report(self):
+        return self.store.memory_report(self.model_name, self.model_version)
+
+    def view(self):
+        """取得权重缓冲区的只读视图，用完后调用release_view"""
+        with self._view_lock:
+            self._views += 1
+        return memoryview(self.buffer)
+
+    def release_view(self, view):
+        """释放视图；已close且这是最后一个视图时解除映射"""
+        view.release()
+        with self._view_lock:
+            self._views -= 1
+            unmap = self._closed and not self._views
+        if unmap:
+            self.buffer.close()
+
+    def close(self):
+        """不再被工厂引用；仍有视图未释放时推迟到最后一个视图释放后解除映射"""
+        with self._view_lock:
+            self._closed = True
+            unmap = not self._views
+        if unmap:
+            self.buffer.close()
+
 
 class ModelFlyweight(AIModel):
     """具体享元对象 - 包含模型实现和状态"""
 
-    def __init__(self, model_key):
+    def __init__(self, model_key, base, max_batch_size=16):
         self.model_key = model_key
-        # 模拟加载大型模型权重
-        self.weights = f"weights_{model_key.model_name}_{model_key.model_version}"
+        self.base = base
+        # 变体不复制权重，只持有基础权重缓冲区的视图
+        self.weights = base.view()
+        self.overhead_mb = round(base.size_mb * QUANTIZED_OVERHEAD) if model_key.quantized else 0
+        # 并发调用经微批处理合并，max_batch_size为1时直接调用
+        self.batcher = MicroBatcher(self.predict_many, max_batch_size) if max_batch_size > 1 else None
         print(f"🔄 加载模型: {model_key.model_name}-{model_key.model_version} "
-              f"(量化={model_key.quantized}) - 权重大小: {len(self.weights)} MB")
+              f"(量化={model_key.quantized}) - 共享基础权重 {base.size_mb} MB, 额外占用 {self.overhead_mb} MB")
+
+    def release(self):
+        """卸载时停止微批处理线程并释放对基础权重的视图"""
+        if self.batcher is not None:
+            self.batcher.close()
+        self.base.release_view(self.weights)
 
     def predict(self, input_data):
         """模型预测方法"""
+        if self.batcher is not None:
+            return self.batcher.submit(input_data)
+        return self.predict_many([input_data])[0]
+
+    def predict_many(self, inputs):
+        """批量预测，一次调用的固定耗时由整批分摊"""
         # 模拟计算耗时
         time.sleep(0.5)
+        self._touch_weights()
+        return [self._predict_one(input_data) for input_data in inputs]
+
+    def _touch_weights(self):
+        """模拟推理读取全部权重(每页读一个字节)，被读到的页面才会常驻内存"""
+        return sum(self.weights[::mmap.PAGESIZE])
+
+    def _predict_one(self, input_data):
+        # 模拟逐个输入的CPU计算
+        h = 0
+        for i in range(CPU_WORK_PER_INPUT):
+            h = (h * 31 + i) % 1000003
 
         # 模拟使用模型权重进行预测
-        result = f"{self.weights.split('_')[1]}预测: 输入'{input_data}' → "
+        result = f"{self.model_key.model_name}预测: 输入'{input_data}' → "
         if "图像" in input_data:
             return result + f"检测到{len(input_data)}个物体"
         elif "文本" in input_data:
@@ -46,20 +262,339 @@ class ModelFlyweight(AIModel):
             return result + "未知类型"
 
 
+_worker_model = None  # worker进程中托管的享元
+
+
+def _init_model_worker(model_key, weights_root):
+    """worker进程初始化：映射共享的权重文件并加载一次享元"""
+    global _worker_model
+    base = BaseWeights(model_key.model_name, model_key.model_version, WeightsStore(weights_root))
+    _worker_model = ModelFlyweight(model_key, base, max_batch_size=1)
+
+
+def _worker_predict_many(inputs):
+    return _worker_model.predict_many(inputs)
+
+
+def _worker_memory_report():
+    return os.getpid(), _worker_model.base.memory_report()
+
+
+class ProcessHostedFlyweight(AIModel):
+    """在worker进程中托管的享元，适合CPU密集的大模型
+
+    各worker只读映射同一个权重文件，共享页缓存，N个worker约占一份权重的内存；
+    合并后的批次按worker数切分并行计算，吞吐随核数增长，不受GIL限制。
+    """
+
+    def __init__(self, model_key, workers=2, max_batch_size=16):
+        self.model_key = model_key
+        self.base = None  # 权重在worker进程中，主进程不持有
+        self.workers = workers
+        self.overhead_mb = MODEL_SIZES_MB.get(model_key.model_name, DEFAULT_MODEL_SIZE_MB)
+        # 先在主进程生成权重文件，worker启动时只需映射
+        weights_store.open(model_key.model_name, model_key.model_version,
+                           self.overhead_mb * BYTES_PER_SIMULATED_MB).close()
+        self._pool = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_model_worker,
+            initargs=(model_key, weights_store.root),
+        )
+        self.batcher = MicroBatcher(self.predict_many, max_batch_size)
+        print(f"🏭 在{workers}个worker进程中托管模型: {model_key.model_name}-{model_key.model_version} "
+              f"(量化={model_key.quantized}) - 占用 {self.overhead_mb} MB")
+
+    def predict(self, input_data):
+        return self.batcher.submit(input_data)
+
+    def predict_many(self, inputs):
+        """按worker数切分批次并行计算"""
+        chunk_size = -(-len(inputs) // self.workers)
+        futures = [self._pool.submit(_worker_predict_many, inputs[i:i + chunk_size])
+                   for i in range(0, len(inputs), chunk_size)]
+        return [result for future in futures for result in future.result()]
+
+    def memory_reports(self):
+        """各worker中权重映射的常驻与共享内存(同一worker可能被采样多次)"""
+        futures = [self._pool.submit(_worker_memory_report) for _ in range(self.workers)]
+        return dict(future.result() for future in futures)
+
+    def release(self):
+        self.batcher.close()
+        self._pool.shutdown()
+
+
 class ModelFactory:
-    """享元工厂 - 管理模型实例"""
-    _models = {}
-    _lock = threading.Lock()
+    """享元工厂 - 管理模型实例
+
+    在内存预算内缓存享元：同一模型版本的变体共享基础权重，只计一次；
+    通过lease借用的享元不会被卸载，超出预算时按LRU卸载空闲享元，
+    没有空闲享元可卸载时等待其他线程归还，超时抛出MemoryError。
+    _lock只保护记账，加载与卸载的耗时操作在锁外进行。
+    """
+    _models = OrderedDict()  # ModelKey -> ModelFlyweight，按最近使用排序
+    _bases = {}  # (模型名, 版本) -> BaseWeights
+    _leases = {}  # ModelKey -> 借用计数
+    _loading = set()  # 正在锁外加载的ModelKey与基础权重(模型名, 版本)
+    _reserved = {}  # 加载中的ModelKey/基础权重 -> 预占的内存(MB)
+    _pending_users = {}  # 加载中的基础权重 -> 等待它的其他变体数，映射完成时一并计入users
+    _lock = threading.Condition()
+    memory_budget_mb = 1024
+    load_timeout = 30.0  # 等待内存释放的最长时间(秒)
+    process_hosted = {}  # 模型名 -> worker进程数，列出的模型由ProcessHostedFlyweight托管
+    loads = 0
+    evictions = 0
+
+    @classmethod
+    def configure(cls, memory_budget_mb=None, load_timeout=None, process_hosted=None):
+        """设置内存预算、等待超时与进程托管的模型"""
+        with cls._lock:
+            if memory_budget_mb is not None:
+                cls.memory_budget_mb = memory_budget_mb
+            if load_timeout is not None:
+                cls.load_timeout = load_timeout
+            if process_hosted is not None:
+                cls.process_hosted = process_hosted
+            cls._lock.notify_all()
 
     @classmethod
     def get_model(cls, model_key):
-        """获取模型实例 - 如果存在则共享，否则创建"""
-        if model_key not in cls._models:
+        """获取模型实例 - 如果存在则共享，否则创建
+
+        返回的实例没有被借用，可能随时因其他模型加载而被卸载，卸载后调用predict抛出RuntimeError；
+        需要在一段时间内持续使用时应通过lease借用。
+        """
+        model = cls._models.get(model_key)
+        if model is None:
+            with cls.lease(model_key) as model:
+                pass
+        return model
+
+    @classmethod
+    @contextmanager
+    def lease(cls, model_key):
+        """借用模型实例，借用期间不会被卸载"""
+        model = cls._acquire(model_key)
+        try:
+            yield model
+        finally:
+            with cls._lock:
+                cls._leases[model_key] -= 1
+                if not cls._leases[model_key]:
+                    del cls._leases[model_key]
+                    cls._lock.notify_all()
+
+    @classmethod
+    def used_mb(cls):
+        """已加载的基础权重、各变体额外占用与加载中预占的内存之和"""
+        return (sum(base.size_mb for base in cls._bases.values())
+                + sum(model.overhead_mb for model in cls._models.values())
+                + sum(cls._reserved.values()))
+
+    @classmethod
+    def _required_mb(cls, model_key):
+        """加载该享元还需要的内存，以及是否需要由本次加载映射基础权重"""
+        size_mb = MODEL_SIZES_MB.get(model_key.model_name, DEFAULT_MODEL_SIZE_MB)
+        if cls.process_hosted.get(model_key.model_name):
+            return size_mb, False  # 各worker映射同一权重文件，共享一份
+        base_key = (model_key.model_name, model_key.model_version)
+        overhead_mb = round(size_mb * QUANTIZED_OVERHEAD) if model_key.quantized else 0
+        if base_key in cls._bases or base_key in cls._loading:
+            return overhead_mb, False
+        return overhead_mb + size_mb, True
+
+    @classmethod
+    def _acquire(cls, model_key):
+        """借用享元(计入借用数)，未加载时预占内存后在锁外加载
+
+        锁内只做记账：映射权重、启动进程池、卸载空闲享元都在锁外进行，
+        借用已加载的享元不会被其他模型的加载阻塞。同一享元的并发加载只进行一次。
+        """
+        deadline = time.time() + cls.load_timeout
+        while True:
+            with cls._lock:
+                model = cls._models.get(model_key)
+                if model is not None:
+                    cls._models.move_to_end(model_key)
+                    cls._leases[model_key] = cls._leases.get(model_key, 0) + 1
+                    return model
+                if model_key in cls._loading:
+                    cls._lock.wait()  # 其他线程正在加载同一享元
+                    continue
+                if cls._fits(model_key):
+                    owns_base = cls._reserve(model_key)
+                    break
+                victims = cls._pop_victims(model_key)
+                if not victims:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise MemoryError(f"模型 {model_key.model_name}-{model_key.model_version} "
+                                          f"超出内存预算 {cls.memory_budget_mb} MB")
+                    cls._lock.wait(remaining)
+                    continue
+            # 在锁外释放摘除的享元后重新检查预算；此时尚未预占，释放出错也不会留下加载中的登记
+            cls._release_victims(victims)
+        return cls._load(model_key, owns_base)
+
+    @classmethod
+    def _fits(cls, model_key):
+        """预算是否放得下该享元，调用方需持有_lock"""
+        return cls.used_mb() + cls._required_mb(model_key)[0] <= cls.memory_budget_mb
+
+    @classmethod
+    def _pop_victims(cls, model_key):
+        """按LRU摘除空闲享元直到放得下该享元或没有可摘除的，调用方需持有_lock并在锁外释放返回的享元"""
+        victims = []
+        while not cls._fits(model_key):
+            victim = cls._pop_victim()
+            if victim is None:
+                break
+            victims.append(victim)
+        return victims
+
+    @classmethod
+    def _reserve(cls, model_key):
+        """预占内存并登记为加载中，返回是否由本次加载映射基础权重，调用方需持有_lock
+
+        基础权重即计入本享元的使用者，加载期间不会因其他变体卸载而被释放。
+        """
+        required_mb, owns_base = cls._required_mb(model_key)
+        cls._loading.add(model_key)
+        base_key = (model_key.model_name, model_key.model_version)
+        if owns_base:
+            cls._loading.add(base_key)
+            cls._reserved[base_key] = MODEL_SIZES_MB.get(model_key.model_name, DEFAULT_MODEL_SIZE_MB)
+            required_mb -= cls._reserved[base_key]
+        elif not cls.process_hosted.get(model_key.model_name):
+            if base_key in cls._bases:
+                cls._bases[base_key].users += 1
+            else:
+                cls._pending_users[base_key] = cls._pending_users.get(base_key, 0) + 1
+        cls._reserved[model_key] = required_mb
+        return owns_base
+
+    @classmethod
+    def _load(cls, model_key, owns_base):
+        """在锁外加载已预占内存的享元，完成后登记并借出"""
+        base_key = (model_key.model_name, model_key.model_version)
+        base = None
+        try:
+            workers = cls.process_hosted.get(model_key.model_name)
+            if workers:
+                model = ProcessHostedFlyweight(model_key, workers)
+            else:
+                base = cls._base(base_key, owns_base)
+                model = ModelFlyweight(model_key, base)
+        except BaseException:
+            with cls._lock:
+                if owns_base and base_key in cls._loading:
+                    cls._loading.discard(base_key)
+                    cls._reserved.pop(base_key, None)
+                    cls._pending_users.pop(base_key, None)
+                if base is not None:
+                    base.users -= 1
+                    if not base.users:
+                        cls._drop_base(base_key, base)
+                    else:
+                        base = None
+                cls._loading.discard(model_key)
+                cls._reserved.pop(model_key, None)
+                cls._lock.notify_all()
+            if base is not None:
+                base.close()
+            raise
+        with cls._lock:
+            cls._loading.discard(model_key)
+            cls._reserved.pop(model_key, None)
+            cls._models[model_key] = model
+            cls._leases[model_key] = cls._leases.get(model_key, 0) + 1
+            cls.loads += 1
+            cls._lock.notify_all()
+        return model
+
+    @classmethod
+    def _base(cls, base_key, owns_base):
+        """取得基础权重(预占时已计入使用者)；由本次加载负责时在锁外映射，否则等待负责的线程映射完成"""
+        if owns_base:
+            base = BaseWeights(*base_key)
             with cls._lock:
-                # 双重检查锁定（线程安全）
-                if model_key not in cls._models:
-                    cls._models[model_key] = ModelFlyweight(model_key)
-        return cls._models[model_key]
+                base.users += 1 + cls._pending_users.pop(base_key, 0)
+                cls._bases[base_key] = base
+                cls._loading.discard(base_key)
+                cls._reserved.pop(base_key, None)
+                cls._lock.notify_all()
+            return base
+        with cls._lock:
+            while base_key not in cls._bases and base_key in cls._loading:
+                cls._lock.wait()
+            base = cls._bases.get(base_key)
+            if base is None:
+                raise RuntimeError(f"基础权重 {base_key[0]}-{base_key[1]} 加载失败")
+            return base
+
+    @classmethod
+    def _pop_victim(cls):
+        """摘除最久未使用的空闲享元，最后一个使用者摘除时一并摘除基础权重，调用方需持有_lock
+
+        返回(享元, 需关闭的基础权重或None)，没有空闲享元时返回None。
+        """
+        victim = next((key for key in cls._models if not cls._leases.get(key)), None)
+        if victim is None:
+            return None
+        model = cls._models.pop(victim)
+        base = model.base
+        if base is not None:
+            base.users -= 1
+            if not base.users:
+                cls._drop_base((victim.model_name, victim.model_version), base)
+            else:
+                base = None
+        cls.evictions += 1
+        return model, base
+
+    @classmethod
+    def _drop_base(cls, base_key, base):
+        """从登记中移除基础权重(只移除同一个对象，期间可能已有新加载的同名权重)"""
+        if cls._bases.get(base_key) is base:
+            del cls._bases[base_key]
+
+    @staticmethod
+    def _release_victims(victims):
+        """在锁外卸载摘除的享元(停止微批处理线程、关闭进程池、释放权重视图)
+
+        基础权重的映射在所有视图释放后才解除，其他线程卸载的变体可能仍持有视图。
+        某个享元释放出错时仍继续释放其余享元，最后抛出第一个错误。
+        """
+        error = None
+        for model, base in victims:
+            try:
+                model.release()
+            except Exception as e:
+                error = error or e
+            if base is not None:
+                base.close()
+            key = model.model_key
+            print(f"🗑️ 卸载空闲模型: {key.model_name}-{key.model_version} (量化={key.quantized})")
+        if error is not None:
+            raise error
+
+    @classmethod
+    def stats(cls):
+        """内存占用、加载与卸载次数"""
+        with cls._lock:
+            return {
+                "used_mb": cls.used_mb(),
+                "budget_mb": cls.memory_budget_mb,
+                "models": len(cls._models),
+                "base_weights": len(cls._bases),
+                "leased": sum(cls._leases.values()),
+                "loading": sum(1 for key in cls._loading if isinstance(key, ModelKey)),
+                "weights_memory": {f"{name}-{version}": base.memory_report()
+                                   for (name, version), base in cls._bases.items()},
+                "loads": cls.loads,
+                "evictions": cls.evictions,
+            }
 
 
 class Client:
@@ -70,11 +605,10 @@ class Client:
 
     def make_request(self, model_key, input_data):
         """发起预测请求"""
-        model = ModelFactory.get_model(model_key)
-
         print(f"👤 客户端[{self.name}]请求: {model_key.model_name}-{model_key.model_version}")
         start_time = time.time()
-        result = model.predict(input_data)
+        with ModelFactory.lease(model_key) as model:
+            result = model.predict(input_data)
         latency = time.time() - start_time
 
         print(f"✅ 返回结果: {result} | 延迟: {latency:.2f}s")
@@ -140,6 +674,39 @@ def main():
     print("\n📊 资源使用统计:")
     print(f"创建的模型实例: {len(ModelFactory._models)}")
     print(f"资源复用情况: BERT模型加载了{1 if bert_model in ModelFactory._models else 0}次，但服务了4个请求")
+    print(f"BERT全精度与量化变体共享基础权重: {len(ModelFactory._bases)}份基础权重, {ModelFactory.stats()}")
+
+    # 内存预算: 多个版本轮流服务时，空闲的旧版本按LRU卸载
+    print("\n=== 内存预算演示 (预算 600 MB) ===")
+    ModelFactory.configure(memory_budget_mb=600)
+    for version in ["v1", "v2", "v3"]:
+        Client("版本灰度").make_request(ModelKey("BERT", version, True), "处理文本: 多版本服务")
+    print(f"📊 {ModelFactory.stats()}")
+
+    # 微批处理: 并发线程对同一享元的调用被合并为少数几次predict_many
+    print("\n=== 微批处理演示 (32个并发请求) ===")
+    burst(ModelKey("BERT", "v3", True), 32)
+
+    # 进程托管: CPU密集的模型在worker进程中并行计算
+    print("\n=== 进程托管演示 (ResNet50, 2个worker) ===")
+    ModelFactory.configure(memory_budget_mb=1024, process_hosted={"ResNet50": 2})
+    resnet_v3 = ModelKey("ResNet50", "v3", False)
+    burst(resnet_v3, 32)
+    with ModelFactory.lease(resnet_v3) as model:
+        for pid, report in model.memory_reports().items():
+            print(f"🧠 worker {pid} 权重映射: {report}")
+
+
+def burst(model_key, n):
+    """n个线程同时请求同一模型，打印总耗时与合并后的批次数"""
+    with ModelFactory.lease(model_key) as model:
+        start = time.time()
+        threads = [threading.Thread(target=model.predict, args=(f"分析图像: 样本{i}",)) for i in range(n)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        print(f"⚡ {n}个请求耗时 {time.time() - start:.2f}s, 合并为 {model.batcher.batches} 次predict_many调用")
 
 
 if __name__ == "__main__":
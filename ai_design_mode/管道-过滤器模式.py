@@ -1,4 +1,8 @@
 from abc import ABC, abstractmethod
+from collections import deque
+import asyncio
+import multiprocessing
+import queue
 import threading
 import time
 import concurrent.futures
@@ -78,13 +82,54 @@ class KeywordExtractor(Filter):
         return data
 
 
+class EmbeddingModel(Filter):
+    def process(self, data):
+        """模拟调用嵌入模型：耗时明显高于其他过滤器"""
+        time.sleep(0.02)
+        vector = [len(word) for word in data.content.split()[:8]]
+        data.add_metadata("EmbeddingModel", vector)
+        print(f"[Embedding] Record {data.id} embedded: {vector[:3]}...")
+        return data
+
+
+def _apply_filter(filter, data):
+    """在worker进程中执行过滤器(记录经pickle往返)"""
+    return filter.process(data)
+
+
+class _Stage:
+    """流水线中的一个阶段：一个过滤器、若干worker与统计"""
+
+    def __init__(self, filter, workers, executor):
+        self.filter = filter
+        self.workers = workers
+        self.executor = executor
+        self.pool = None
+        self.processed = 0
+        self.busy = 0.0  # worker执行过滤器的累计时间
+        self.starved = 0.0  # 等待上游输入的累计时间
+        self.blocked = 0.0  # 下游队列已满、等待放入的累计时间
+        self.lock = threading.Lock()
+
+    def name(self):
+        return self.filter.__class__.__name__
+
+
+_STOP = object()  # 阶段间的结束标记
+
+
 class DataPipeline:
-    def __init__(self):
+    def __init__(self, max_workers=4):
         self.filters = []
-        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=4)
+        self.stage_options = []  # 与filters一一对应的(worker数, 执行方式)
+        self.stage_stats = []  # 最近一次pipelined_process的各阶段统计
+        self.max_workers = max_workers
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
 
-    def add_filter(self, filter):
+    def add_filter(self, filter, workers=1, executor="thread"):
+        """添加过滤器；workers与executor(thread/process)只用于pipelined_process"""
         self.filters.append(filter)
+        self.stage_options.append((workers, executor))
 
     def process(self, data):
         """顺序执行所有过滤器处理"""
@@ -105,6 +150,202 @@ class DataPipeline:
 
         return results
 
+    def stream_process(self, records, window=None, ordered=True):
+        """流式处理：惰性读取records，最多window条记录在途，结果处理完即产出
+
+        内存占用只与window有关，与输入总量无关；ordered=False时按完成顺序产出。
+        """
+        window = window or self.max_workers * 2
+        pending = deque()
+        try:
+            for record in records:
+                pending.append(self.executor.submit(self.process, record))
+                # 已完成的结果立即产出，窗口满时阻塞等待
+                yield from self._drain(pending, ordered, block=len(pending) >= window)
+            while pending:
+                yield from self._drain(pending, ordered, block=True)
+        finally:
+            # 调用方提前停止迭代时取消尚未开始的记录
+            for future in pending:
+                future.cancel()
+
+    @staticmethod
+    def _drain(pending, ordered, block):
+        """产出已完成的结果；block时至少等待一个结果"""
+        if ordered:
+            if block:
+                yield pending.popleft().result()
+            while pending and pending[0].done():
+                yield pending.popleft().result()
+            return
+        if block:
+            concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in [f for f in pending if f.done()]:
+            pending.remove(future)
+            yield future.result()
+
+    async def astream_process(self, records, window=None):
+        """异步流式处理：records可以是普通或异步可迭代对象，按输入顺序产出结果"""
+        window = window or self.max_workers * 2
+        loop = asyncio.get_running_loop()
+        pending = deque()
+        try:
+            async for record in self._aiter(records):
+                pending.append(loop.run_in_executor(self.executor, self.process, record))
+                if len(pending) >= window:
+                    yield await pending.popleft()
+                while pending and pending[0].done():
+                    yield pending.popleft().result()
+            while pending:
+                yield await pending.popleft()
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def pipelined_process(self, records, queue_size=16):
+        """流水线并行处理：每个过滤器是独立阶段，阶段之间用有界队列衔接
+
+        各阶段按add_filter指定的worker数并发，process执行方式的阶段在独立进程池中运行。
+        结果按完成顺序产出；结束后stage_stats给出各阶段利用率，用于找到并扩容瓶颈阶段。
+        读取records时抛出的异常在已读入的记录产出后重新抛给调用方。
+        """
+        if not self.filters:
+            self.stage_stats = []
+            yield from records
+            return
+
+        stages = [_Stage(filter, workers, executor)
+                  for filter, (workers, executor) in zip(self.filters, self.stage_options)]
+        queues = [queue.Queue(maxsize=queue_size) for _ in range(len(stages) + 1)]
+        stop = threading.Event()
+        errors = []  # 读取输入时的异常
+        start = time.time()
+        for stage in stages:
+            if stage.executor == "process":
+                stage.pool = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=stage.workers, mp_context=multiprocessing.get_context("spawn"))
+
+        threads = [threading.Thread(target=self._feed, args=(records, queues[0], stages[0].workers, stop, errors),
+                                    daemon=True)]
+        remaining = [stage.workers for stage in stages]  # 各阶段尚未退出的worker数
+        for index, stage in enumerate(stages):
+            next_workers = stages[index + 1].workers if index + 1 < len(stages) else 1
+            for _ in range(stage.workers):
+                threads.append(threading.Thread(
+                    target=self._run_stage,
+                    args=(stage, queues[index], queues[index + 1], next_workers, remaining, index, stop),
+                    daemon=True))
+        for thread in threads:
+            thread.start()
+
+        try:
+            while (record := self._get(queues[-1], stop)) is not _STOP:
+                yield record
+            if errors:
+                raise errors[0]
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+            for stage in stages:
+                if stage.pool is not None:
+                    stage.pool.shutdown()
+            elapsed = time.time() - start
+            self.stage_stats = [{
+                "stage": stage.name(),
+                "workers": stage.workers,
+                "executor": stage.executor,
+                "processed": stage.processed,
+                "utilization": stage.busy / (stage.workers * elapsed) if elapsed else 0.0,
+                "starved_s": stage.starved,
+                "blocked_s": stage.blocked,
+            } for stage in stages]
+
+    @staticmethod
+    def _put(q, item, stop):
+        """放入有界队列，流水线停止时放弃"""
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    @staticmethod
+    def _get(q, stop):
+        """从队列取出一项，流水线停止时返回结束标记"""
+        while not stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _STOP
+
+    def _feed(self, records, q, workers, stop, errors):
+        """惰性读取输入放入第一个阶段的队列，结束(或读取出错)后给每个worker一个结束标记"""
+        try:
+            for record in records:
+                if not self._put(q, record, stop):
+                    return
+        except Exception as e:
+            errors.append(e)
+        for _ in range(workers):
+            self._put(q, _STOP, stop)
+
+    def _run_stage(self, stage, inbox, outbox, next_workers, remaining, index, stop):
+        """阶段worker循环；阶段最后一个退出的worker负责向下游传递结束标记"""
+        while True:
+            wait_start = time.time()
+            data = self._get(inbox, stop)
+            waited = time.time() - wait_start
+            if data is _STOP:
+                break
+            busy_start = time.time()
+            try:
+                if stage.pool is not None:
+                    data = stage.pool.submit(_apply_filter, stage.filter, data).result()
+                else:
+                    data = stage.filter.process(data)
+            except Exception as e:
+                print(f"Error processing record {data.id} at {stage.name()}: {e}")
+            busy = time.time() - busy_start
+            put_start = time.time()
+            if not self._put(outbox, data, stop):
+                break
+            with stage.lock:
+                stage.processed += 1
+                stage.starved += waited
+                stage.busy += busy
+                stage.blocked += time.time() - put_start
+
+        with stage.lock:
+            remaining[index] -= 1
+            last = remaining[index] == 0
+        if last:
+            for _ in range(next_workers):
+                self._put(outbox, _STOP, stop)
+
+    def report_utilization(self):
+        """打印最近一次流水线运行的各阶段利用率，标出瓶颈阶段"""
+        if not self.stage_stats:
+            return
+        bottleneck = max(self.stage_stats, key=lambda s: s["utilization"])
+        for stats in self.stage_stats:
+            marker = " <- 瓶颈" if stats is bottleneck else ""
+            print(f"{stats['stage']:<18} workers={stats['workers']} ({stats['executor']}) "
+                  f"processed={stats['processed']} utilization={stats['utilization']:.0%} "
+                  f"starved={stats['starved_s']:.2f}s blocked={stats['blocked_s']:.2f}s{marker}")
+
+    @staticmethod
+    async def _aiter(records):
+        if hasattr(records, "__aiter__"):
+            async for record in records:
+                yield record
+        else:
+            for record in records:
+                yield record
+
 
 if __name__ == "__main__":
     # 创建测试数据
@@ -136,3 +377,40 @@ if __name__ == "__main__":
     print("\n并行处理完成:")
     for record in parallel_results:
         print(f"Record {record.id} sentiment: {record.metadata['stages'][1]['result']}")
+
+    # 流式处理演示：记录由生成器逐条产生，结果边处理边产出
+    print("\n===== 流式处理演示 =====")
+    texts = [record.content for record in sample_data]
+
+    def generate_records(n):
+        for i in range(n):
+            yield DataRecord(100 + i, texts[i % len(texts)])
+
+    start = time.time()
+    for i, record in enumerate(pipeline.stream_process(generate_records(10), window=4)):
+        if i == 0:
+            print(f"首个结果耗时 {time.time() - start:.4f}s")
+        print(f"Record {record.id} sentiment: {record.metadata['stages'][1]['result']}")
+
+    async def async_demo():
+        async def records_from_socket(n):
+            for i in range(n):
+                await asyncio.sleep(0.01)  # 模拟逐条到达的网络数据
+                yield DataRecord(200 + i, texts[i % len(texts)])
+
+        async for record in pipeline.astream_process(records_from_socket(5), window=2):
+            print(f"[async] Record {record.id} sentiment: {record.metadata['stages'][1]['result']}")
+
+    asyncio.run(async_demo())
+
+    # 流水线并行演示：嵌入模型阶段最慢，单独给它更多worker
+    print("\n===== 流水线并行演示 =====")
+    for embedding_workers in (1, 4):
+        staged = DataPipeline()
+        staged.add_filter(TextCleaner())
+        staged.add_filter(EmbeddingModel(), workers=embedding_workers)
+        staged.add_filter(SentimentAnalyzer())
+        start = time.time()
+        count = sum(1 for _ in staged.pipelined_process(generate_records(40), queue_size=8))
+        print(f"\n嵌入阶段{embedding_workers}个worker: 处理{count}条记录耗时 {time.time() - start:.2f}s")
+        staged.report_utilization()
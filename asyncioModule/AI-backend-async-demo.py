@@ -1,11 +1,36 @@
+import argparse
 import asyncio
+import bisect
+import functools
+import gc
+import hashlib
+import heapq
 import json
+import math
+import multiprocessing
+import os
+import pickle
+import sqlite3
+import sys
 import time
 import logging
+import random
+import re
+from abc import ABC, abstractmethod
+from array import array
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from contextlib import asynccontextmanager
-from dataclasses import dataclass
-from functools import lru_cache
-from typing import Any, AsyncGenerator, Callable, Dict, List, Optional
+from dataclasses import dataclass, field
+from enum import Enum, IntEnum
+from itertools import islice
+from multiprocessing import shared_memory
+from typing import Any, AsyncGenerator, Callable, Dict, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # numpy可选，仅影响tensor模式的视图类型与计算速度
+    np = None
 
 # --- 配置日志记录 ---
 logging.basicConfig(
@@ -21,37 +46,378 @@ logger = logging.getLogger("ai-backend")
 # --- 全局配置 ---
 CONFIG = {
     "max_concurrent": 100,  # 最大并发请求数
+    "tenant_quotas": {},  # 租户 -> (令牌桶容量, 每秒补充速率)，未配置的租户使用默认配额
+    "rate_limit_wait": 0.0,  # 令牌不足时最多等待的秒数，0表示立即拒绝
+    "min_batch_size": 1,  # 自适应批大小下限
     "max_batch_size": 32,  # 批处理最大大小
     "max_batch_time": 0.1,  # 批处理最大等待时间(秒)
-    "model_cache_size": 2,  # 模型缓存数量
+    "target_p99_latency": 0.2,  # 单批推理延迟的目标p99(秒)
+    "latency_window": 100,  # 计算p99所用的最近批次数
+    "request_timeout": 10.0,  # 单个请求的默认截止时间(秒)
+    "request_pool_size": 0,  # AIRequest空闲链表容量，0表示不复用请求对象
+    "queue_capacity": 1000,  # 每个模型入口队列的最大长度
+    "queue_overflow_policy": "block",  # 队列满时的策略，见OverflowPolicy
+    "queue_block_timeout": 1.0,  # block策略下入队的最长等待时间(秒)
+    "priority_weights": {"interactive": 8, "normal": 2, "bulk": 1},  # 各优先级类别的公平排队权重
+    "tenant_weights": {},  # 租户 -> 权重倍数，未配置为1
+    "cache_backend": "memory",  # 缓存后端: memory(进程内) / sqlite(多进程共享)
+    "cache_path": "prediction_cache.db",  # sqlite后端的数据库文件
+    "cache_ttl": 300,  # 预测缓存有效期(秒)
+    "cache_policy": "lru",  # 缓存淘汰策略: lru / lfu / tinylfu
+    "cache_max_entries": 10000,  # 缓存最大条目数
+    "cache_max_bytes": 64 * 1024 * 1024,  # 缓存内存预算(按结果大小估算)
+    "cache_sweep_interval": 5.0,  # 后台清理过期条目的间隔(秒)
+    "semantic_cache_models": {},  # 模型名 -> SemanticCache参数(可为空dict)，只有列出的模型启用语义缓存
+    "semantic_cache_threshold": 0.9,  # 余弦相似度不低于该值才复用结果
+    "semantic_cache_embedder": "char_ngram",  # 嵌入函数，见SEMANTIC_EMBEDDERS
+    "semantic_cache_dim": 2048,  # 嵌入向量维度(哈希桶数，过小时不同输入易碰撞)
+    "semantic_cache_max_entries": 5000,  # 每个模型索引保留的最近输入数
+    "semantic_cache_verify_rate": 0.0,  # 语义命中后台重新推理校验的抽样比例，用于统计误命中(只对输出确定的模型生效)
+    "model_cache_size": 2,  # 模型缓存数量(按模型名计，dedicated副本的多个实例计为一个)
+    "model_memory_budget_mb": 4096,  # 模型池内存预算(MB)
+    "model_memory_mb": {},  # 模型名 -> 估算占用(MB)，未配置的按default_model_memory_mb计
+    "default_model_memory_mb": 1024,
+    "preload_models": ["default"],  # 启动时并行预热的模型
+    "model_versions": {},  # 模型名 -> 版本号，热更新时由ModelFactory.reload修改
+    "drain_timeout": 10.0,  # 停机时等待排队与推理中请求完成的最长时间(秒)
+    "replicas": {},  # 模型名 -> 批处理副本数，未配置的按default_replicas
+    "default_replicas": 1,
+    "replica_backends": {},  # 模型名 -> shared(默认，所有副本共用一个模型实例) / dedicated(每个副本加载独立实例)
+    "dispatch_policy": "least_loaded",  # 副本选择: least_loaded(队列深度) / ewma_latency(预计等待时间)
+    "stream_slots": 32,  # 流式生成时每个副本同时解码的序列数
+    "breaker_failure_threshold": 0.5,  # 窗口内失败或慢调用比例达到该值时熔断
+    "breaker_slow_call_latency": 1.0,  # 单批推理超过该延迟(秒)视为慢调用
+    "breaker_window": 20,  # 熔断统计的最近批次数
+    "breaker_min_calls": 5,  # 至少统计这么多批次才判断熔断
+    "breaker_cooldown": 5.0,  # 熔断后等待多久放行试探批次(秒)
+    "breaker_trial_timeout": 10.0,  # 试探批次超过该时间(秒)仍未结束时允许重新试探
+    "health_check_interval": 1.0,  # 后台健康探测间隔(秒)
+    "hedge_enabled": False,  # 批次超过本副本p95延迟时是否向另一副本发起对冲请求(需replica_backends为dedicated)
+    "hedge_min_samples": 20,  # 计算p95所需的最少批次数
+    "execution_modes": {},  # 模型名 -> async(默认，协程内推理) / process(进程池推理) / tensor(数值批次零拷贝)
+    "tensor_models": {},  # 模型名 -> {"input_dim": ..., "output_dim": ...}，tensor模式使用
+    "process_pool_workers": None,  # 进程池worker数，默认CPU核数
+    "process_start_method": "spawn",  # worker进程启动方式，避免fork带有线程的事件循环进程
+    "shm_threshold_bytes": 64 * 1024,  # 超过该大小的批次输入/输出经共享内存传递
+    "cpu_model_work_rounds": 2000,  # LocalCPUModel每个输入的模拟计算量
+    "metrics_port": None,  # 设置后在127.0.0.1:<port>/metrics导出Prometheus指标
+    "request_log_sample_rate": 0.01,  # 单个请求日志的抽样比例，0关闭，1全量
 }
 
 
+# --- 指标监控 ---
+class MetricCounter:
+    """单调递增计数器
+
+    所有更新都发生在事件循环线程上，普通整数自增即可，不需要锁。
+    """
+
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount: int = 1):
+        self.value += amount
+
+
+class CallbackGauge:
+    """抓取时调用回调取值的仪表盘指标(队列深度等)"""
+
+    __slots__ = ("fn",)
+
+    def __init__(self, fn: Callable[[], float]):
+        self.fn = fn
+
+    @property
+    def value(self) -> float:
+        return self.fn()
+
+
+class LatencyHistogram:
+    """HDR风格的对数-线性直方图
+
+    值按scale换算为整数后，按2的幂分段、每段再线性细分为16个桶，相对误差不超过1/16；
+    记录为O(1)，内存只随实际出现的桶数增长。
+    """
+
+    SUB_BUCKET_BITS = 5  # 小于2^5的值逐一成桶，之后每段16个桶
+    HALF_SUB_BUCKETS = 1 << (SUB_BUCKET_BITS - 1)
+
+    __slots__ = ("scale", "counts", "count", "sum", "max")
+
+    def __init__(self, scale: float = 1e6):
+        self.scale = scale  # 秒按微秒精度记录；批大小等整数值用scale=1
+        self.counts: Dict[int, int] = {}
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def _index(self, v: int) -> int:
+        shift = v.bit_length() - self.SUB_BUCKET_BITS
+        if shift <= 0:
+            return v
+        return shift * self.HALF_SUB_BUCKETS + (v >> shift)
+
+    def _bucket_value(self, index: int) -> float:
+        """桶的代表值(区间中点)"""
+        if index < (1 << self.SUB_BUCKET_BITS):
+            return index / self.scale
+        shift, top = divmod(index, self.HALF_SUB_BUCKETS)
+        top += self.HALF_SUB_BUCKETS
+        shift -= 1
+        low = top << shift
+        return (low + ((1 << shift) - 1) / 2) / self.scale
+
+    def observe(self, value: float):
+        index = self._index(max(0, int(value * self.scale)))
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, q: float) -> float:
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return min(self._bucket_value(index), self.max)
+        return self.max
+
+
+class MetricsRegistry:
+    """进程内指标注册表，按(指标名, 标签)复用指标对象，并导出Prometheus文本格式"""
+
+    QUANTILES = (0.5, 0.9, 0.99, 0.999)
+
+    def __init__(self):
+        self._families: Dict[str, tuple] = {}  # name -> (类型, 说明, {标签元组: 指标})
+
+    def _get(self, kind: str, name: str, help: str, labels: Dict[str, Any], factory: Callable):
+        family = self._families.get(name)
+        if family is None:
+            family = self._families[name] = (kind, help, {})
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        metric = family[2].get(key)
+        if metric is None:
+            metric = family[2][key] = factory()
+        return metric
+
+    def counter(self, name: str, help: str = "", **labels) -> MetricCounter:
+        return self._get("counter", name, help, labels, MetricCounter)
+
+    def histogram(self, name: str, help: str = "", scale: float = 1e6, **labels) -> LatencyHistogram:
+        return self._get("summary", name, help, labels, lambda: LatencyHistogram(scale))
+
+    def gauge(self, name: str, fn: Callable[[], float], help: str = "", **labels) -> CallbackGauge:
+        gauge = self._get("gauge", name, help, labels, lambda: CallbackGauge(fn))
+        gauge.fn = fn
+        return gauge
+
+    @staticmethod
+    def _format_labels(key: tuple, extra: Optional[tuple] = None) -> str:
+        pairs = list(key) + ([extra] if extra else [])
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+    def render(self) -> str:
+        """导出Prometheus文本格式(text/plain; version=0.0.4)"""
+        lines = []
+        for name, (kind, help, metrics) in sorted(self._families.items()):
+            if help:
+                lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for key, metric in metrics.items():
+                if kind == "summary":
+                    for q in self.QUANTILES:
+                        lines.append(f"{name}{self._format_labels(key, ('quantile', q))} {metric.percentile(q)}")
+                    lines.append(f"{name}_sum{self._format_labels(key)} {metric.sum}")
+                    lines.append(f"{name}_count{self._format_labels(key)} {metric.count}")
+                else:
+                    lines.append(f"{name}{self._format_labels(key)} {metric.value}")
+        return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """极简HTTP服务，在GET /metrics上导出注册表"""
+
+    def __init__(self, registry: MetricsRegistry, host: str = "127.0.0.1", port: int = 9100):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        logger.info(f"Metrics endpoint listening on http://{self.host}:{self.port}/metrics")
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = await reader.readline()
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass  # 忽略请求头
+            parts = request_line.split()
+            if len(parts) >= 2 and parts[0] == b"GET" and parts[1].split(b"?")[0] == b"/metrics":
+                status, body = "200 OK", self.registry.render().encode()
+            else:
+                status, body = "404 Not Found", b"not found\n"
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        finally:
+            writer.close()
+
+
+metrics = MetricsRegistry()
+
+
+def should_log_request() -> bool:
+    """按request_log_sample_rate抽样决定是否记录单个请求的日志"""
+    rate = CONFIG["request_log_sample_rate"]
+    return rate >= 1 or (rate > 0 and random.random() < rate)
+
+
 # --- 核心数据结构 ---
-@dataclass
+class AIRequestError(Exception):
+    """请求在批处理阶段失败(模型不可用、推理异常等)"""
+
+
+class QueueFullError(AIRequestError):
+    """入口队列已满，请求被拒绝或被淘汰"""
+
+
+class CircuitOpenError(AIRequestError):
+    """模型后端已熔断，请求被快速失败"""
+
+
+class ServiceShuttingDownError(AIRequestError):
+    """服务正在停机，不再接收新请求"""
+
+
+@dataclass(slots=True)
 class AIRequest:
     request_id: str
     data: Any
-    created_at: float = time.time()
+    priority: int = 1  # 数值越大越重要(见Priority)，决定公平排队权重与过载时的保留顺序
+    tenant: str = "default"  # 租户/API Key，限流按此分桶
+    created_at: float = field(default_factory=time.monotonic)  # 创建时间(time.monotonic)
     result: Optional[Any] = None
     error: Optional[str] = None
-
-
-@dataclass
+    deadline: Optional[float] = None  # 截止时间(time.monotonic)
+    enqueued_at: float = 0.0  # 进入批处理队列的时间(time.monotonic)
+    future: Optional[asyncio.Future] = field(default=None, repr=False, compare=False)
+    stream: Optional[asyncio.Queue] = field(default=None, repr=False, compare=False)  # 流式输出的分片
+
+    def attach_future(self) -> asyncio.Future:
+        """绑定当前事件循环上的完成Future，等待方只需await它"""
+        if self.future is None:
+            self.future = asyncio.get_running_loop().create_future()
+        return self.future
+
+    def set_result(self, response: "AIResponse"):
+        """回填结果并唤醒等待该请求的协程"""
+        self.result = response
+        if self.future is not None and not self.future.done():
+            self.future.set_result(response)
+        self.end_stream()
+
+    def set_error(self, error: str):
+        """标记失败并以异常唤醒等待该请求的协程"""
+        self.error = error
+        if self.future is not None and not self.future.done():
+            self.future.set_exception(AIRequestError(error))
+        self.end_stream()
+
+    def cancel(self):
+        """调用方已放弃该请求：取消Future，批处理在组批前丢弃它，流式序列在下一步中止"""
+        if self.future is not None:
+            self.future.cancel()
+        self.end_stream()
+
+    @property
+    def cancelled(self) -> bool:
+        return self.future is not None and self.future.cancelled()
+
+    def push_chunk(self, chunk: str):
+        """推送一个流式输出分片"""
+        if self.stream is not None:
+            self.stream.put_nowait(chunk)
+
+    def end_stream(self):
+        """以None标记流式输出结束"""
+        if self.stream is not None:
+            self.stream.put_nowait(None)
+            self.stream = None
+
+
+@dataclass(slots=True)
 class AIResponse:
     request_id: str
     result: Any
     latency: float
-    processed_at: float = time.time()
+    processed_at: float = field(default_factory=time.monotonic)  # 完成时间(time.monotonic)
+    error: Optional[str] = None
+    cached: bool = False  # 是否由预测缓存直接返回
+    similarity: Optional[float] = None  # 语义缓存命中时与历史输入的相似度
+
+
+class RecordPool:
+    """记录对象的空闲链表，复用已结束的对象以降低高吞吐下的分配与GC压力
+
+    acquire时重新执行__init__，所有字段(包括时间戳、future)都会重置为新对象的状态。
+    调用方必须保证release后不再有任何地方引用该对象。
+    """
+
+    def __init__(self, factory: type, max_size: int):
+        self.factory = factory
+        self.max_size = max_size
+        self._free: List[Any] = []
+        self.created = 0
+        self.reused = 0
+
+    def acquire(self, **fields) -> Any:
+        if self._free:
+            record = self._free.pop()
+            record.__init__(**fields)
+            self.reused += 1
+            return record
+        self.created += 1
+        return self.factory(**fields)
+
+    def release(self, record: Any):
+        if len(self._free) < self.max_size:
+            self._free.append(record)
+
+    def stats(self) -> Dict[str, int]:
+        return {"created": self.created, "reused": self.reused, "free": len(self._free)}
 
 
 # --- 模型服务抽象层 ---
 class AIModelAdapter:
     """统一模型接口适配器"""
 
+    deterministic = False  # 相同输入是否总是得到相同结果；模拟结果带时间戳，不满足
+
     def __init__(self, model_name: str):
         self.model_name = model_name
-        logger.info(f"Initialized model adapter for: {model_name}")
+        self.version = CONFIG["model_versions"].get(model_name, "v1")
+        self.memory_mb = CONFIG["model_memory_mb"].get(model_name, CONFIG["default_model_memory_mb"])
+        logger.info(f"Initialized model adapter for: {model_name} ({self.version})")
 
     async def warmup(self):
         """预热模型(加载权重等)"""
@@ -67,157 +433,2203 @@ class AIModelAdapter:
         return [f"{self.model_name}: Result for {input} at {time.time()}"
                 for input in inputs]
 
+    def init_stream(self, input: Any) -> deque:
+        """为一个序列创建解码状态(流式生成)"""
+        # 实际项目中为KV缓存等解码状态，这里用待输出的词模拟
+        return deque(f"{self.model_name}: Result for {input}".split())
+
+    async def decode_step(self, states: List[deque]) -> List[Tuple[str, bool]]:
+        """对一组序列各解码一步，返回每个序列的(输出分片, 是否结束)"""
+        await asyncio.sleep(0.01)  # 模拟单步解码延迟
+        outputs = []
+        for state in states:
+            token = state.popleft()
+            outputs.append((token if not state else token + " ", not state))
+        return outputs
+
     async def health_check(self) -> bool:
         """模型健康检查"""
         return True
 
+    async def unload(self):
+        """释放模型权重等资源"""
+        logger.info(f"Unloading model: {self.model_name}")
+
+
+# --- 进程池执行(CPU密集型模型) ---
+class LocalCPUModel:
+    """模拟本地CPU密集型模型(如sentence-transformer、sklearn分类器)，在worker进程中同步推理"""
+
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+        time.sleep(0.1)  # 模拟加载权重
+
+    def predict(self, inputs: List[Any]) -> List[Any]:
+        results = []
+        for input in inputs:
+            digest = str(input).encode()
+            for _ in range(CONFIG["cpu_model_work_rounds"]):  # 模拟CPU计算
+                digest = hashlib.sha256(digest).digest()
+            results.append(f"{self.model_name}: Result for {input} ({digest.hex()[:8]})")
+        return results
+
+
+_worker_model: Optional[LocalCPUModel] = None  # 每个worker进程内预热好的模型
+
+
+def _init_model_worker(model_name: str):
+    """worker进程初始化：加载一次模型，之后的批次直接复用"""
+    global _worker_model
+    _worker_model = LocalCPUModel(model_name)
+
+
+def _worker_ping() -> int:
+    return os.getpid()
+
+
+def _pack_payload(obj: Any) -> tuple:
+    """序列化对象；超过阈值的负载写入共享内存，只通过管道传递共享内存名"""
+    data = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+    if len(data) < CONFIG["shm_threshold_bytes"]:
+        return ("inline", data)
+    shm = shared_memory.SharedMemory(create=True, size=len(data))
+    shm.buf[:len(data)] = data
+    shm.close()
+    return ("shm", shm.name, len(data))
+
+
+def _unpack_payload(payload: tuple, unlink: bool) -> Any:
+    """反序列化_pack_payload的结果，unlink为True时读取后释放共享内存"""
+    if payload[0] == "inline":
+        return pickle.loads(payload[1])
+    _, name, size = payload
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        with shm.buf[:size] as view:
+            return pickle.loads(view)
+    finally:
+        shm.close()
+        if unlink:
+            shm.unlink()
+
+
+def _release_payload(payload: tuple):
+    """释放未被读取的共享内存负载"""
+    if payload[0] == "shm":
+        try:
+            shm = shared_memory.SharedMemory(name=payload[1])
+        except FileNotFoundError:
+            return
+        shm.close()
+        shm.unlink()
+
+
+def _worker_predict(payload: tuple) -> tuple:
+    """worker进程中执行一个分片的推理"""
+    inputs = _unpack_payload(payload, unlink=False)  # 输入由主进程释放
+    return _pack_payload(_worker_model.predict(inputs))
+
+
+class ProcessPoolModelAdapter(AIModelAdapter):
+    """把批次分片交给ProcessPoolExecutor中预热好的模型worker执行
+
+    CPU推理在独立进程中进行，既不阻塞事件循环，也不受GIL限制，可用满所有核心。
+    """
+
+    deterministic = True
+
+    def __init__(self, model_name: str, workers: Optional[int] = None):
+        super().__init__(model_name)
+        self.workers = workers or os.cpu_count() or 1
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    async def warmup(self):
+        """启动worker进程并等待每个worker完成模型加载"""
+        logger.info(f"Warming up {self.workers} worker processes for model: {self.model_name}")
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context(CONFIG["process_start_method"]),
+            initializer=_init_model_worker,
+            initargs=(self.model_name,),
+        )
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(self._pool, _worker_ping)
+                               for _ in range(self.workers)))
+
+    async def predict(self, inputs: List[Any]) -> List[Any]:
+        """批量推理接口：按worker数切分批次并行执行"""
+        loop = asyncio.get_running_loop()
+        chunk_size = max(1, -(-len(inputs) // self.workers))
+        payloads = [_pack_payload(inputs[i:i + chunk_size]) for i in range(0, len(inputs), chunk_size)]
+        try:
+            outputs = await asyncio.gather(*(loop.run_in_executor(self._pool, _worker_predict, payload)
+                                             for payload in payloads))
+        finally:
+            for payload in payloads:
+                _release_payload(payload)
+        results = []
+        for output in outputs:
+            results.extend(_unpack_payload(output, unlink=True))
+        return results
+
+    async def health_check(self) -> bool:
+        """进程池可用即视为健康"""
+        if self._pool is None:
+            return False
+        try:
+            await asyncio.wait_for(asyncio.get_running_loop().run_in_executor(self._pool, _worker_ping), 5.0)
+            return True
+        except Exception:
+            return False
+
+    async def unload(self):
+        """关闭worker进程"""
+        await super().unload()
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+class TensorRingBuffer:
+    """预分配在共享内存中的float32环形缓冲区，用于数值批次(embedding/特征向量)
+
+    输入、输出各一块共享内存，按槽位划分，每个槽位可容纳slot_rows行。主进程把请求
+    向量逐行直接写入空闲槽位，worker按槽位号映射同一块内存原地读写，批次数据不再序列化。
+    有numpy时视图为ndarray，否则退化为memoryview。
+    """
+
+    ITEMSIZE = 4  # float32
+
+    def __init__(self, slots: int, slot_rows: int, input_dim: int, output_dim: int,
+                 names: Optional[Tuple[str, str]] = None):
+        self.slots = slots
+        self.slot_rows = slot_rows
+        self.input_dim = input_dim
+        self.output_dim = output_dim
+        create = names is None
+        self.input_shm = shared_memory.SharedMemory(
+            name=None if create else names[0], create=create,
+            size=slots * slot_rows * input_dim * self.ITEMSIZE)
+        self.output_shm = shared_memory.SharedMemory(
+            name=None if create else names[1], create=create,
+            size=slots * slot_rows * output_dim * self.ITEMSIZE)
+        self.owner = create
+        self._exports: List[memoryview] = []
+        self._inputs = self._flat(self.input_shm, slots * slot_rows * input_dim)
+        self._outputs = self._flat(self.output_shm, slots * slot_rows * output_dim)
+
+    def _flat(self, shm: shared_memory.SharedMemory, length: int):
+        if np is not None:
+            return np.ndarray((length,), dtype=np.float32, buffer=shm.buf)
+        cast = shm.buf.cast("f")
+        flat = cast[:length]
+        self._exports += [flat, cast]  # 关闭前需逐个释放，否则共享内存无法close
+        return flat
+
+    @property
+    def names(self) -> Tuple[str, str]:
+        return self.input_shm.name, self.output_shm.name
+
+    def _view(self, flat, dim: int, slot: int, rows: int):
+        start = slot * self.slot_rows * dim
+        view = flat[start:start + rows * dim]
+        return view.reshape(rows, dim) if np is not None else view
+
+    def input_view(self, slot: int, rows: int):
+        """槽位输入区域的视图(不复制)，numpy下形状为(rows, input_dim)"""
+        return self._view(self._inputs, self.input_dim, slot, rows)
+
+    def output_view(self, slot: int, rows: int):
+        """槽位输出区域的视图(不复制)，numpy下形状为(rows, output_dim)"""
+        return self._view(self._outputs, self.output_dim, slot, rows)
+
+    def write_rows(self, slot: int, rows: List[Any]):
+        """把每个请求的向量直接写入槽位的对应行"""
+        view = self.input_view(slot, len(rows))
+        dim = self.input_dim
+        for i, row in enumerate(rows):
+            if len(row) != dim:
+                raise ValueError(f"Expected input vector of length {dim}, got {len(row)}")
+            if np is not None:
+                view[i] = row
+            else:
+                view[i * dim:(i + 1) * dim] = array("f", row)
+
+    def read_rows(self, slot: int, rows: int) -> List[Any]:
+        """取出槽位的输出；槽位随后会被复用，因此每行复制为独立的float列表返回"""
+        view = self.output_view(slot, rows)
+        if np is not None:
+            return view.tolist()
+        dim = self.output_dim
+        return [list(view[i * dim:(i + 1) * dim]) for i in range(rows)]
+
+    def close(self):
+        """释放视图并关闭共享内存，创建方同时删除共享内存"""
+        for view in self._exports:
+            view.release()
+        self._exports.clear()
+        self._inputs = self._outputs = None
+        self.input_shm.close()
+        self.output_shm.close()
+        if self.owner:
+            self.input_shm.unlink()
+            self.output_shm.unlink()
+
+
+class LocalTensorModel:
+    """模拟数值输入的CPU模型：输出 tanh(X·W)，直接写入输出视图"""
+
+    def __init__(self, model_name: str, input_dim: int, output_dim: int):
+        self.model_name = model_name
+        self.input_dim = input_dim
+        self.output_dim = output_dim
+        rng = random.Random(model_name)
+        scale = 1 / input_dim ** 0.5
+        weights = [[rng.gauss(0, scale) for _ in range(output_dim)] for _ in range(input_dim)]
+        self.weights = np.array(weights, dtype=np.float32) if np is not None else weights
+
+    def predict_into(self, inputs, outputs, rows: int):
+        if np is not None:
+            np.tanh(inputs @ self.weights, out=outputs)
+            return
+        in_dim, out_dim = self.input_dim, self.output_dim
+        for r in range(rows):
+            x = inputs[r * in_dim:(r + 1) * in_dim]
+            for j in range(out_dim):
+                outputs[r * out_dim + j] = math.tanh(sum(x[k] * self.weights[k][j] for k in range(in_dim)))
+
+
+_worker_ring: Optional[TensorRingBuffer] = None  # worker进程映射的共享环形缓冲区
+
+
+def _init_tensor_worker(model_name: str, names: Tuple[str, str], slots: int, slot_rows: int,
+                        input_dim: int, output_dim: int):
+    """worker进程初始化：映射共享缓冲区并加载一次模型"""
+    global _worker_model, _worker_ring
+    _worker_ring = TensorRingBuffer(slots, slot_rows, input_dim, output_dim, names=names)
+    _worker_model = LocalTensorModel(model_name, input_dim, output_dim)
+
+
+def _worker_predict_slot(slot: int, rows: int):
+    """worker进程中对一个槽位原地推理，结果写入输出缓冲区"""
+    _worker_model.predict_into(_worker_ring.input_view(slot, rows), _worker_ring.output_view(slot, rows), rows)
+
+
+class TensorModelAdapter(ProcessPoolModelAdapter):
+    """数值输入模型的进程池适配器，批次经TensorRingBuffer零拷贝传给worker
+
+    每个请求的data为长度input_dim的数值序列；返回值为长度output_dim的向量。
+    """
+
+    deterministic = False  # 批大小不同时矩阵乘法的累加顺序可能不同，结果不保证逐位一致
+
+    def __init__(self, model_name: str, workers: Optional[int] = None, input_dim: int = 384,
+                 output_dim: int = 16, slots: Optional[int] = None):
+        super().__init__(model_name, workers)
+        self.input_dim = input_dim
+        self.output_dim = output_dim
+        self.slots = slots or 2 * self.workers  # 每个worker可以有一个槽位在计算、一个在填充
+        self.ring: Optional[TensorRingBuffer] = None
+        self._free_slots: Optional[asyncio.Queue] = None
+
+    async def warmup(self):
+        """分配共享环形缓冲区，启动并预热worker进程"""
+        logger.info(f"Warming up {self.workers} tensor workers for model: {self.model_name}")
+        self.ring = TensorRingBuffer(self.slots, CONFIG["max_batch_size"], self.input_dim, self.output_dim)
+        self._free_slots = asyncio.Queue()
+        for slot in range(self.slots):
+            self._free_slots.put_nowait(slot)
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context(CONFIG["process_start_method"]),
+            initializer=_init_tensor_worker,
+            initargs=(self.model_name, self.ring.names, self.slots, self.ring.slot_rows,
+                      self.input_dim, self.output_dim),
+        )
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(self._pool, _worker_ping)
+                               for _ in range(self.workers)))
+
+    async def _predict_chunk(self, rows: List[Any]) -> List[Any]:
+        slot = await self._free_slots.get()
+        try:
+            self.ring.write_rows(slot, rows)
+            await asyncio.get_running_loop().run_in_executor(
+                self._pool, _worker_predict_slot, slot, len(rows))
+            return self.ring.read_rows(slot, len(rows))
+        finally:
+            self._free_slots.put_nowait(slot)
+
+    async def predict(self, inputs: List[Any]) -> List[Any]:
+        """批量推理接口：按worker数与槽位容量切分，各分片写入独立槽位并行计算"""
+        chunk_size = min(self.ring.slot_rows, max(1, -(-len(inputs) // self.workers)))
+        chunks = await asyncio.gather(*(self._predict_chunk(inputs[i:i + chunk_size])
+                                        for i in range(0, len(inputs), chunk_size)))
+        return [row for chunk in chunks for row in chunk]
+
+    async def unload(self):
+        """关闭worker进程并释放共享缓冲区"""
+        pool, self._pool = self._pool, None
+        if pool is not None:
+            # 等worker进程退出后再删除共享内存段，避免仍在初始化的worker映射已删除的段
+            await asyncio.get_running_loop().run_in_executor(
+                None, functools.partial(pool.shutdown, cancel_futures=True))
+        await super().unload()
+        if self.ring is not None:
+            self.ring.close()
+            self.ring = None
+
+
+def model_adapter_type(model_name: str) -> type:
+    """按CONFIG选择模型的适配器类型"""
+    mode = CONFIG["execution_modes"].get(model_name)
+    if mode == "process":
+        return ProcessPoolModelAdapter
+    if mode == "tensor":
+        return TensorModelAdapter
+    return AIModelAdapter
+
+
+def create_model_adapter(model_name: str) -> AIModelAdapter:
+    """按CONFIG选择模型的执行方式"""
+    adapter_type = model_adapter_type(model_name)
+    if adapter_type is TensorModelAdapter:
+        return TensorModelAdapter(model_name, workers=CONFIG["process_pool_workers"],
+                                  **CONFIG["tensor_models"].get(model_name, {}))
+    if adapter_type is ProcessPoolModelAdapter:
+        return ProcessPoolModelAdapter(model_name, workers=CONFIG["process_pool_workers"])
+    return AIModelAdapter(model_name)
+
+
+def backend_key(model_name: str, replica_id: int = 0) -> str:
+    """副本使用的模型实例键：shared模式下所有副本共用模型名，dedicated模式为'模型名#副本号'"""
+    if CONFIG["replica_backends"].get(model_name, "shared") == "dedicated":
+        return f"{model_name}#{replica_id}"
+    return model_name
+
+
+def backend_model(key: str) -> str:
+    """模型实例键对应的模型名"""
+    return key.partition("#")[0]
+
 
 # --- 模型工厂(享元模式) ---
 class ModelFactory:
-    """模型工厂，提供模型实例的共享和复用"""
+    """模型工厂，提供模型实例的共享和复用
+
+    同一模型的并发加载合并为一次预热；模型数量与估算内存超出限制时，
+    按LRU卸载当前没有被借用的模型。reload可在不中断服务的情况下热更新模型版本。
+    实例按backend_key区分，dedicated副本的每个实例单独加载、计入内存预算；
+    数量限制model_cache_size按模型名统计，同一模型的副本实例不会互相挤出。
+    """
 
-    _models = {}
+    _models: "OrderedDict[str, AIModelAdapter]" = OrderedDict()  # 按最近使用排序
+    _loading: Dict[str, asyncio.Task] = {}  # 正在加载(或热更新)的模型，同一模型同时只有一个
+    _reserved_mb: Dict[str, int] = {}  # 加载中模型预占的内存
+    _active: Dict[str, int] = {}  # 模型 -> 正在使用它的批次数
+    _leases: Dict[AIModelAdapter, int] = {}  # 模型实例 -> 借用数，热更新时据此等待旧版本空闲
+    load_times: Dict[str, float] = {}  # 模型 -> 最近一次加载耗时(秒)
 
     @classmethod
     async def get_model(cls, model_name: str) -> AIModelAdapter:
         """获取模型实例(共享)"""
-        if model_name not in cls._models:
-            model = AIModelAdapter(model_name)
+        model = cls._models.get(model_name)
+        if model is not None:
+            cls._models.move_to_end(model_name)
+            return model
+
+        task = cls._loading.get(model_name) or cls._start_load(model_name)
+        return await asyncio.shield(task)
+
+    @classmethod
+    def _start_load(cls, model_name: str) -> asyncio.Task:
+        """启动加载任务并登记到_loading，完成后移除"""
+        task = asyncio.create_task(cls._load(model_name))
+        cls._loading[model_name] = task
+        task.add_done_callback(
+            lambda done: cls._loading.pop(model_name) if cls._loading.get(model_name) is done else None)
+        return task
+
+    @classmethod
+    async def _load(cls, model_name: str) -> AIModelAdapter:
+        start_time = time.monotonic()
+        model = create_model_adapter(backend_model(model_name))
+        cls._reserved_mb[model_name] = model.memory_mb
+        try:
+            await cls._trim(keep=model_name)
             await model.warmup()
-            cls._models[model_name] = model
-            logger.info(f"Created new model instance: {model_name}")
-        else:
-            logger.info(f"Reusing cached model: {model_name}")
-        return cls._models[model_name]
+        finally:
+            del cls._reserved_mb[model_name]
+        cls._models[model_name] = model
+        # 并行加载期间预算可能被暂时突破，加载完成后再收缩一次
+        await cls._trim(keep=model_name)
+        cls.load_times[model_name] = time.monotonic() - start_time
+        logger.info(f"Created new model instance: {model_name} "
+                    f"(load time: {cls.load_times[model_name]:.4f}s)")
+        return model
+
+    @classmethod
+    def used_mb(cls) -> int:
+        """已加载与加载中模型的估算内存"""
+        return sum(m.memory_mb for m in cls._models.values()) + sum(cls._reserved_mb.values())
+
+    @classmethod
+    def model_count(cls) -> int:
+        """已加载与加载中的模型数(dedicated副本的多个实例只计一次)"""
+        return len({backend_model(key) for key in (*cls._models, *cls._reserved_mb)})
+
+    @classmethod
+    async def _trim(cls, keep: str):
+        """按LRU卸载空闲模型，直到数量与内存回到限制以内
+
+        只是模型数超限时不卸载与keep同一模型的其他副本实例，卸载它们不会减少模型数。
+        """
+        keep_model = backend_model(keep)
+        while True:
+            over_memory = cls.used_mb() > CONFIG["model_memory_budget_mb"]
+            if not over_memory and cls.model_count() <= CONFIG["model_cache_size"]:
+                return
+            victim = next((name for name in cls._models
+                           if name != keep and not cls._active.get(name)
+                           and (over_memory or backend_model(name) != keep_model)), None)
+            if victim is None:
+                logger.warning("Model pool over budget; remaining models are in use or still loading")
+                return
+            await cls._models.pop(victim).unload()
+
+    @classmethod
+    def peek(cls, model_name: str) -> Optional[AIModelAdapter]:
+        """返回已加载的模型实例，不触发加载"""
+        return cls._models.get(model_name)
+
+    @classmethod
+    @asynccontextmanager
+    async def use(cls, model_name: str):
+        """借用模型实例，借用期间不会被卸载"""
+        model = await cls.get_model(model_name)
+        cls._active[model_name] = cls._active.get(model_name, 0) + 1
+        cls._leases[model] = cls._leases.get(model, 0) + 1
+        try:
+            yield model
+        finally:
+            cls._active[model_name] -= 1
+            cls._leases[model] -= 1
+            if not cls._leases[model]:
+                del cls._leases[model]
+
+    @classmethod
+    async def reload(cls, model_name: str, version: Optional[str] = None) -> AIModelAdapter:
+        """热更新模型版本
+
+        新版本预热期间旧版本继续服务；预热完成后原子替换，之后的批次借用到新版本，
+        旧版本等正在推理的批次归还后再卸载。排队中的请求不受影响。
+        """
+        if version is not None:
+            CONFIG["model_versions"][model_name] = version
+        keys = [key for key in dict.fromkeys([*cls._models, *cls._loading])
+                if backend_model(key) == model_name]
+        if not keys:
+            return await cls.get_model(backend_key(model_name))
+        models = await asyncio.gather(*(cls._swap(key) for key in keys))
+        return models[0]
+
+    @classmethod
+    async def _swap(cls, key: str) -> AIModelAdapter:
+        """加载一个实例的新版本并替换旧版本；同一实例的并发热更新依次执行"""
+        while (task := cls._loading.get(key)) is not None and not task.done():
+            await asyncio.wait({task})
+        old = cls._models.get(key)
+        if old is None:
+            return await cls.get_model(key)
+
+        model = await asyncio.shield(cls._start_load(key))
+        while cls._leases.get(old):
+            await asyncio.sleep(0.01)
+        await old.unload()
+        logger.info(f"Hot-swapped model {key}: {old.version} -> {model.version}")
+        return model
+
+    @classmethod
+    async def preload(cls, model_names: List[str]):
+        """启动时并行预热模型列表(dedicated模式下预热每个副本的实例)"""
+        keys = list(dict.fromkeys(
+            backend_key(name, i) for name in model_names
+            for i in range(CONFIG["replicas"].get(name, CONFIG["default_replicas"]))))
+        for name in model_names:
+            required_mb = (sum(1 for key in keys if backend_model(key) == name)
+                           * CONFIG["model_memory_mb"].get(name, CONFIG["default_model_memory_mb"]))
+            if required_mb > CONFIG["model_memory_budget_mb"]:
+                logger.warning(f"Model {name} needs {required_mb} MB for all replica instances, "
+                               f"over model_memory_budget_mb={CONFIG['model_memory_budget_mb']}; "
+                               f"replicas will evict each other")
+        results = await asyncio.gather(*(cls.get_model(key) for key in keys),
+                                       return_exceptions=True)
+        for name, result in zip(keys, results):
+            if isinstance(result, Exception):
+                logger.error(f"Failed to preload model {name}: {result}")
+
+    @classmethod
+    async def unload_all(cls):
+        """停机时卸载所有模型(释放进程池、共享内存等资源)"""
+        while cls._models:
+            _, model = cls._models.popitem(last=False)
+            await model.unload()
+
+    @classmethod
+    def stats(cls) -> Dict[str, Any]:
+        """模型池状态与各模型加载耗时"""
+        return {
+            "used_mb": cls.used_mb(),
+            "budget_mb": CONFIG["model_memory_budget_mb"],
+            "models": {
+                name: {
+                    "version": model.version,
+                    "memory_mb": model.memory_mb,
+                    "active": cls._active.get(name, 0),
+                    "load_time": cls.load_times.get(name),
+                }
+                for name, model in cls._models.items()
+            },
+        }
+
+
+# --- 入口队列(背压与降级) ---
+class OverflowPolicy(Enum):
+    BLOCK = "block"  # 阻塞等待空位，超时后拒绝
+    REJECT_NEWEST = "reject_newest"  # 直接拒绝新请求
+    DROP_OLDEST_EXPIRED = "drop_oldest_expired"  # 淘汰已过截止时间的旧请求腾出空位
+    SHED_PRIORITY = "shed_priority"  # 淘汰优先级更低的请求腾出空位
+
+
+class Priority(IntEnum):
+    """请求优先级类别，数值越大越重要"""
+    BULK = 0  # 离线批量任务
+    NORMAL = 1
+    INTERACTIVE = 2  # 在线交互请求
+
+
+def priority_class(priority: int) -> str:
+    """优先级对应的类别名，用于权重配置与分类指标"""
+    try:
+        return Priority(priority).name.lower()
+    except ValueError:
+        return str(priority)
+
+
+@dataclass(slots=True)
+class PriorityClass:
+    """入口队列中一个优先级类别的权重、排队记账与排队时间指标"""
+    name: str
+    weight: float
+    waits: deque  # 最近排队时间
+    wait_histogram: LatencyHistogram
+    depth: int = 0  # 当前排队数
+
+
+class IngressQueue:
+    """有界请求队列，满载时按策略背压或降级，并统计队列深度与排队时间
+
+    按(优先级类别, 租户)划分流，出队采用自计时加权公平排队(SCFQ)：请求入队时
+    得到完成标签 max(虚拟时间, 本流上一标签) + 1/权重，按标签从小到大组批。
+    高权重的交互流量优先获得批槽位，批量流量填充剩余槽位且不会被饿死。
+    """
+
+    def __init__(self, capacity: int, policy: OverflowPolicy = OverflowPolicy.BLOCK,
+                 block_timeout: float = 1.0, window: int = 1000,
+                 priority_weights: Optional[Dict[str, float]] = None,
+                 tenant_weights: Optional[Dict[str, float]] = None,
+                 metric_labels: Optional[Dict[str, Any]] = None):
+        self.capacity = capacity
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.priority_weights = priority_weights or {}
+        self.tenant_weights = tenant_weights or {}
+        self._flows: Dict[tuple, deque] = {}  # 流 -> [(完成标签, 序号, 请求)]
+        self._last_finish: Dict[tuple, float] = {}
+        self._heads: List[tuple] = []  # 各流队首的(完成标签, 序号, 流)，失效条目出队时跳过
+        self._virtual_time = 0.0
+        self._seq = 0
+        self._size = 0
+        self._not_full = asyncio.Event()
+        self._not_full.set()
+        self._window = window
+        self._metric_labels = metric_labels or {}
+        # 优先级 -> 类别记账，已知优先级在构造时解析好指标，入队出队不再查找注册表
+        self._classes: Dict[int, PriorityClass] = {}
+        for priority in Priority:
+            self._class(priority)
+        self.enqueued = 0
+        self.rejected = 0
+        self.dropped = 0
+        self.expired = 0  # 出队时已过截止时间而被丢弃的请求数
+        self.cancelled = 0  # 出队时调用方已放弃而被丢弃的请求数
+        self._discarded_metrics = {
+            reason: metrics.counter("ai_queue_discarded_total",
+                                    "Requests discarded at batch formation (expired or cancelled)",
+                                    reason=reason, **self._metric_labels)
+            for reason in ("expired", "cancelled")
+        }
+        self.high_water = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __bool__(self) -> bool:
+        return self._size > 0
+
+    def _class(self, priority: int) -> PriorityClass:
+        """优先级对应的类别记账，未知优先级首次出现时创建"""
+        cls = self._classes.get(priority)
+        if cls is None:
+            name = priority_class(priority)
+            cls = self._classes[priority] = PriorityClass(
+                name=name,
+                weight=self.priority_weights.get(name, 1.0),
+                waits=deque(maxlen=self._window),
+                wait_histogram=metrics.histogram(
+                    "ai_queue_wait_seconds", "Time requests spend in the ingress queue",
+                    priority=name, **self._metric_labels),
+            )
+        return cls
+
+    def _requests(self):
+        for flow in self._flows.values():
+            for _, _, request in flow:
+                yield request
+
+    def peek(self, n: int) -> List[AIRequest]:
+        """按出队顺序查看最先出队的n个请求(不出队)"""
+        return [request for _, _, request in islice(heapq.merge(*self._flows.values()), n)]
+
+    async def put(self, request: AIRequest):
+        """入队，队列满时按溢出策略处理，无法入队时抛出QueueFullError"""
+        if self._size >= self.capacity and not await self._make_room(request):
+            self.rejected += 1
+            raise QueueFullError(f"Queue full ({self.policy.value})")
+
+        cls = self._class(request.priority)
+        key = (request.priority, request.tenant)
+        weight = cls.weight * self.tenant_weights.get(request.tenant, 1.0)
+        finish = max(self._virtual_time, self._last_finish.get(key, 0.0)) + 1.0 / weight
+        self._last_finish[key] = finish
+        self._seq += 1
+        entry = (finish, self._seq, request)
+        flow = self._flows.get(key)
+        if flow is None:
+            flow = self._flows[key] = deque()
+        flow.append(entry)
+        if len(flow) == 1:
+            heapq.heappush(self._heads, (finish, self._seq, key))
+
+        request.enqueued_at = time.monotonic()
+        self._size += 1
+        cls.depth += 1
+        self.enqueued += 1
+        self.high_water = max(self.high_water, self._size)
+        if self._size >= self.capacity:
+            self._not_full.clear()
+
+    def take(self, n: int) -> List[AIRequest]:
+        """按完成标签顺序取出最多n个请求，并记录各类别的排队时间
+
+        调用方已放弃或已过截止时间的请求在此丢弃，不占用批槽位和模型算力。
+        """
+        now = time.monotonic()
+        taken = []
+        while len(taken) < n and self._heads:
+            finish, seq, key = heapq.heappop(self._heads)
+            flow = self._flows.get(key)
+            if not flow or flow[0][1] != seq:
+                continue  # 队首已被淘汰，条目失效
+            _, _, request = flow.popleft()
+            self._virtual_time = finish
+            if flow:
+                heapq.heappush(self._heads, (flow[0][0], flow[0][1], key))
+            else:
+                del self._flows[key]
+                del self._last_finish[key]
+            self._size -= 1
+            cls = self._class(request.priority)
+            cls.depth -= 1
+            if request.cancelled:
+                self.cancelled += 1
+                self._discarded_metrics["cancelled"].inc()
+                continue
+            if request.deadline is not None and request.deadline <= now:
+                self.expired += 1
+                self._discarded_metrics["expired"].inc()
+                request.set_error("Deadline exceeded in queue")
+                continue
+            wait = now - request.enqueued_at
+            cls.waits.append(wait)
+            cls.wait_histogram.observe(wait)
+            taken.append(request)
+        if self._size < self.capacity:
+            self._not_full.set()
+        return taken
+
+    async def _make_room(self, request: AIRequest) -> bool:
+        """按溢出策略尝试腾出一个空位"""
+        if self.policy is OverflowPolicy.BLOCK:
+            deadline = time.monotonic() + self.block_timeout
+            while self._size >= self.capacity:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                try:
+                    await asyncio.wait_for(self._not_full.wait(), timeout=remaining)
+                except asyncio.TimeoutError:
+                    return False
+            return True
+
+        if self.policy is OverflowPolicy.DROP_OLDEST_EXPIRED:
+            now = time.monotonic()
+            expired = [req for req in self._requests() if req.deadline is not None and req.deadline <= now]
+            for req in expired:
+                self._evict(req, "Deadline exceeded in queue")
+            return self._size < self.capacity
+
+        if self.policy is OverflowPolicy.SHED_PRIORITY:
+            # 淘汰优先级最低的请求中最新到达的一个
+            victim = None
+            for req in self._requests():
+                if victim is None or req.priority < victim.priority or (
+                        req.priority == victim.priority and req.enqueued_at >= victim.enqueued_at):
+                    victim = req
+            if victim is not None and victim.priority < request.priority:
+                self._evict(victim, "Shed by higher priority request")
+                return True
+            return False
+
+        return False
+
+    def _evict(self, request: AIRequest, reason: str):
+        """移出队列中的请求并以QueueFullError唤醒其等待方"""
+        key = (request.priority, request.tenant)
+        flow = self._flows[key]
+        index = next(i for i, (_, _, req) in enumerate(flow) if req is request)
+        del flow[index]
+        if not flow:
+            del self._flows[key]
+        elif index == 0:
+            heapq.heappush(self._heads, (flow[0][0], flow[0][1], key))
+        self._size -= 1
+        self._class(request.priority).depth -= 1
+        self.dropped += 1
+        request.error = reason
+        if request.future is not None and not request.future.done():
+            request.future.set_exception(QueueFullError(reason))
+        request.end_stream()
+
+    @staticmethod
+    def _summarize(waits) -> Dict[str, float]:
+        waits = sorted(waits)
+        return {
+            "wait_avg": sum(waits) / len(waits) if waits else 0.0,
+            "wait_p99": waits[min(len(waits) - 1, int(len(waits) * 0.99))] if waits else 0.0,
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        """队列深度与排队时间指标(含各优先级类别)"""
+        all_waits = [w for cls in self._classes.values() for w in cls.waits]
+        return {
+            "depth": self._size,
+            "capacity": self.capacity,
+            "high_water": self.high_water,
+            "enqueued": self.enqueued,
+            "rejected": self.rejected,
+            "dropped": self.dropped,
+            "expired": self.expired,
+            "cancelled": self.cancelled,
+            **self._summarize(all_waits),
+            "classes": {
+                cls.name: {"depth": cls.depth, "served": len(cls.waits), **self._summarize(cls.waits)}
+                for cls in self._classes.values()
+            },
+        }
+
+
+# --- 熔断器 ---
+class CircuitState(Enum):
+    CLOSED = "closed"  # 正常放行
+    OPEN = "open"  # 熔断，快速失败
+    HALF_OPEN = "half_open"  # 冷却结束，放行一个试探批次
+
+
+class CircuitBreaker:
+    """熔断器：最近窗口内失败或慢调用的比例超过阈值时打开，冷却后放行一次试探
+
+    allow返回本次调用的许可(关闭状态为0，半开状态为试探编号)，record与release_trial带上许可；
+    半开状态只由当前试探的结果决定开合，熔断前已放行的批次晚到的结果不计入。
+    """
+
+    def __init__(self, name: str, failure_threshold: float = 0.5, slow_call_latency: float = 1.0,
+                 window: int = 20, min_calls: int = 5, cooldown: float = 5.0,
+                 trial_timeout: float = 10.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.slow_call_latency = slow_call_latency
+        self.min_calls = min_calls
+        self.cooldown = cooldown
+        self.trial_timeout = trial_timeout
+        self.outcomes = deque(maxlen=window)  # True表示失败或慢调用
+        self.state = CircuitState.CLOSED
+        self.opened_at = 0.0
+        self.trips = 0
+        self._trial: Optional[int] = None  # 正在进行的试探编号
+        self._trial_started = 0.0
+        self._trials = 0  # 已发出的试探数，用于生成试探编号
+
+    def _trial_pending(self, now: float) -> bool:
+        """是否有试探批次正在进行(超过trial_timeout视为已丢失)"""
+        return self._trial is not None and now - self._trial_started < self.trial_timeout
+
+    def available(self) -> bool:
+        """是否可以接收新请求(未熔断且没有试探在进行，或冷却已结束)"""
+        now = time.monotonic()
+        if self.state is CircuitState.OPEN:
+            return now - self.opened_at >= self.cooldown
+        return self.state is CircuitState.CLOSED or not self._trial_pending(now)
+
+    def allow(self) -> Optional[int]:
+        """放行一次调用时返回许可，拒绝时返回None；半开状态同一时间只放行一个试探"""
+        if self.state is CircuitState.CLOSED:
+            return 0
+        now = time.monotonic()
+        if self.state is CircuitState.OPEN:
+            if now - self.opened_at < self.cooldown:
+                return None
+            self.state = CircuitState.HALF_OPEN
+            self._trial = None
+        if self._trial_pending(now):
+            return None
+        self._trials += 1
+        self._trial = self._trials
+        self._trial_started = now
+        return self._trial
+
+    def release_trial(self, permit: int):
+        """调用结束；该许可是当前试探且没有记录结果(加载失败、请求全部取消、被取消)时按失败处理"""
+        if self.state is CircuitState.HALF_OPEN and permit and permit == self._trial:
+            self.record(False, permit=permit)
+
+    def record(self, ok: bool, latency: float = 0.0, permit: int = 0):
+        """记录一次调用结果；熔断期间与半开状态下非当前试探的结果被忽略"""
+        bad = not ok or latency > self.slow_call_latency
+        if self.state is CircuitState.OPEN:
+            return
+        if self.state is CircuitState.HALF_OPEN:
+            if not permit or permit != self._trial:
+                return
+            self._trial = None
+            if bad:
+                self.trip("trial call failed")
+            else:
+                logger.info(f"Circuit {self.name} closed")
+                self.state = CircuitState.CLOSED
+                self.outcomes.clear()
+            return
+
+        self.outcomes.append(bad)
+        if (len(self.outcomes) >= self.min_calls
+                and sum(self.outcomes) / len(self.outcomes) >= self.failure_threshold):
+            self.trip("failure rate exceeded")
+
+    def trip(self, reason: str):
+        """打开熔断器"""
+        if self.state is not CircuitState.OPEN:
+            logger.warning(f"Circuit {self.name} opened: {reason}")
+            self.trips += 1
+        self.state = CircuitState.OPEN
+        self.opened_at = time.monotonic()
+        self.outcomes.clear()
+        self._trial = None
 
 
 # --- 批处理系统 ---
+class AdaptiveBatchSizer:
+    """根据实测推理延迟在线调整批大小(AIMD)
+
+    最近窗口的p99超过目标时乘性减小批大小；满批且p99留有余量时加性增大。
+    """
+
+    def __init__(self, min_size: int, max_size: int, target_p99: float, window: int = 100):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.target_p99 = target_p99
+        self.size = max(min_size, max_size // 4)
+        self.latencies = deque(maxlen=window)
+        self.expected_latency = 0.0  # 推理延迟的EWMA，用于截止时间判断
+
+    def percentile(self, q: float) -> float:
+        """最近窗口内推理延迟的q分位数"""
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+    def p99(self) -> float:
+        """最近窗口内的推理延迟p99"""
+        return self.percentile(0.99)
+
+    def observe(self, batch_len: int, latency: float):
+        """记录一次批推理的延迟并调整批大小"""
+        self.latencies.append(latency)
+        if self.expected_latency:
+            self.expected_latency = 0.8 * self.expected_latency + 0.2 * latency
+        else:
+            self.expected_latency = latency
+
+        if latency > self.target_p99 or (len(self.latencies) >= 10 and self.p99() > self.target_p99):
+            self.size = max(self.min_size, int(self.size * 0.7))
+            self.latencies.clear()  # 换挡后重新采样
+        elif batch_len >= self.size and self.p99() < self.target_p99 * 0.8:
+            self.size = min(self.max_size, self.size + max(1, self.size // 8))
+
+
 class BatchProcessor:
-    """智能批处理系统，提高吞吐量"""
+    """智能批处理系统，提高吞吐量
 
-    def __init__(self, model_name: str):
+    满足以下任一条件即下发批次：达到当前批大小、最老请求等待超过max_batch_time、
+    最紧的截止时间只够再跑一次推理、或按到达速率预计等不满一批。
+    熔断器按模型实例统计：共用实例的副本应传入同一个breaker。
+    """
+
+    kind = "batch"  # 队列指标的kind标签，区分同一模型副本的批处理与流式队列
+
+    def __init__(self, model_name: str, replica_id: int = 0,
+                 breaker: Optional[CircuitBreaker] = None):
         self.model_name = model_name
-        self.batch: List[AIRequest] = []
+        self.replica_id = replica_id
+        self.backend = backend_key(model_name, replica_id)  # ModelFactory中的模型实例键
+        self.in_flight = 0  # 正在推理的批次中的请求数
+        self._task: Optional[asyncio.Task] = None
+        self._health_task: Optional[asyncio.Task] = None
+        self.batch_sizes: Counter = Counter()  # 批大小 -> 批次数
+        self.dispatcher: Optional["ReplicaDispatcher"] = None  # 所属调度器，用于对冲请求
+        self.breaker = breaker or CircuitBreaker(
+            self.backend,
+            failure_threshold=CONFIG["breaker_failure_threshold"],
+            slow_call_latency=CONFIG["breaker_slow_call_latency"],
+            window=CONFIG["breaker_window"],
+            min_calls=CONFIG["breaker_min_calls"],
+            cooldown=CONFIG["breaker_cooldown"],
+            trial_timeout=CONFIG["breaker_trial_timeout"],
+        )
+        self.hedged = 0  # 发起对冲的批次数
+        self.hedge_wins = 0  # 对冲请求先返回的批次数
+        self.queue = IngressQueue(
+            capacity=CONFIG["queue_capacity"],
+            policy=OverflowPolicy(CONFIG["queue_overflow_policy"]),
+            block_timeout=CONFIG["queue_block_timeout"],
+            priority_weights=CONFIG["priority_weights"],
+            tenant_weights=CONFIG["tenant_weights"],
+            metric_labels={"model": model_name, "replica": replica_id, "kind": self.kind},
+        )
+        metrics.gauge("ai_queue_depth", lambda: len(self.queue), "Requests waiting in the ingress queue",
+                      model=model_name, replica=replica_id, kind=self.kind)
+        self._batch_size_metric = metrics.histogram(
+            "ai_batch_size", "Requests per model batch", scale=1, model=model_name)
+        self._model_latency_metric = metrics.histogram(
+            "ai_model_latency_seconds", "Model predict latency per batch", model=model_name)
         self.batch_event = asyncio.Event()
         self.is_processing = False
-        self.model = None
-        logger.info(f"Initialized batch processor for: {model_name}")
-
-    async def start_processing(self):
-        """启动批处理任务循环"""
-        asyncio.create_task(self._process_batches())
+        self.draining = False  # 停机排空中：不再等待凑批，已排队的请求立即下发
+        self.sizer = AdaptiveBatchSizer(
+            min_size=CONFIG["min_batch_size"],
+            max_size=CONFIG["max_batch_size"],
+            target_p99=CONFIG["target_p99_latency"],
+            window=CONFIG["latency_window"],
+        )
+        self.arrival_interval = float("inf")  # 请求到达间隔的EWMA
+        self._last_arrival: Optional[float] = None
+        logger.info(f"Initialized batch processor for: {model_name} (replica {replica_id})")
+
+    @property
+    def batch_size(self) -> int:
+        """当前自适应批大小"""
+        return self.sizer.size
+
+    async def start_processing(self, health_probe: bool = True):
+        """启动批处理任务循环与后台健康探测(共用实例的副本只需一个探测)"""
+        self._task = asyncio.create_task(self._process_batches())
+        if health_probe:
+            self._health_task = asyncio.create_task(self._health_loop())
+
+    async def _health_loop(self):
+        """后台周期性健康探测，失败时熔断，避免每个批次都做一次健康检查"""
+        while True:
+            await asyncio.sleep(CONFIG["health_check_interval"])
+            model = ModelFactory.peek(self.backend)
+            if model is None:
+                continue  # 模型尚未加载或已被卸载
+            try:
+                healthy = await model.health_check()
+            except Exception:
+                healthy = False
+            if not healthy:
+                self.breaker.trip("health check failed")
 
     async def add_request(self, request: AIRequest):
-        """添加请求到批处理队列"""
-        self.batch.append(request)
-
-        # 触发批处理条件
-        if len(self.batch) >= CONFIG["max_batch_size"]:
-            self.batch_event.set()
+        """添加请求到批处理队列，队列满且无法腾出空位时抛出QueueFullError，
+        排空开始后抛出ServiceShuttingDownError"""
+        if self.draining:
+            raise ServiceShuttingDownError("Service shutting down")
+        request.attach_future()
+        await self.queue.put(request)
+
+        now = request.enqueued_at
+        if self._last_arrival is not None:
+            interval = now - self._last_arrival
+            if self.arrival_interval == float("inf"):
+                self.arrival_interval = interval
+            else:
+                self.arrival_interval = 0.8 * self.arrival_interval + 0.2 * interval
+        self._last_arrival = now
+
+        # 唤醒批处理循环重新评估下发条件
+        self.batch_event.set()
+
+    def _flush_delay(self, now: float) -> float:
+        """距离必须下发当前批次还剩多少秒，<=0表示立即下发"""
+        pending = self.queue.peek(self.batch_size)
+        # 按WFQ顺序的队首不一定是最早入队的请求(先到的BULK可能排在后到的INTERACTIVE之后)
+        delay = min(req.enqueued_at for req in pending) + CONFIG["max_batch_time"] - now
+
+        # 截止时间：给最紧的请求留出一次推理的时间
+        deadlines = [req.deadline for req in pending if req.deadline is not None]
+        if deadlines:
+            delay = min(delay, min(deadlines) - now - self.sizer.expected_latency)
+
+        # 按当前到达速率在剩余时间内凑不满一批，继续等待只会增加延迟
+        missing = self.batch_size - len(pending)
+        if missing * self.arrival_interval > delay:
+            return 0.0
+        return delay
+
+    async def _next_batch(self) -> List[AIRequest]:
+        """等待下发条件成立并取出一个非空批次(取出时会丢弃已取消或过期的请求)"""
+        while True:
             self.batch_event.clear()
+            if not self.queue:
+                await self.batch_event.wait()
+                continue
+
+            if len(self.queue) < self.batch_size and not self.draining:
+                delay = self._flush_delay(time.monotonic())
+                if delay > 0:
+                    try:
+                        await asyncio.wait_for(self.batch_event.wait(), timeout=delay)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+
+            batch = self.queue.take(self.batch_size)
+            if batch:
+                return batch
 
     async def _process_batches(self):
         """批处理核心逻辑"""
         while True:
-            # 等待触发条件：达到最大批处理大小或超时
-            await asyncio.wait_for(
-                self.batch_event.wait(),
-                timeout=CONFIG["max_batch_time"]
-            )
-
-            if not self.batch:
-                continue
-
             # 获取当前批处理
-            current_batch = self.batch.copy()
-            self.batch = []
-
-            # 确保模型加载
-            if not self.model:
-                self.model = await ModelFactory.get_model(self.model_name)
+            current_batch = await self._next_batch()
 
-            # 健康检查
-            if not await self.model.health_check():
-                logger.error(f"Model {self.model_name} health check failed!")
+            # 熔断期间快速失败
+            permit = self.breaker.allow()
+            if permit is None:
                 for req in current_batch:
-                    req.error = "Model unavailable"
+                    req.set_error("Model unavailable (circuit open)")
                 continue
 
+            self.in_flight = len(current_batch)
+            try:
+                # 借用模型实例(按需加载)，推理期间不会被模型池卸载
+                async with ModelFactory.use(self.backend) as model:
+                    await self._run_batch(model, current_batch, permit)
+            except asyncio.CancelledError:
+                for req in current_batch:
+                    req.set_error("Service shutting down")
+                raise
+            except Exception as e:
+                logger.exception("Batch processing failed")
+                for req in current_batch:
+                    req.set_error(f"Processing error: {str(e)}")
+            finally:
+                self.in_flight = 0
+                self.breaker.release_trial(permit)
+
+    async def drain(self, deadline: float):
+        """停机排空：立即下发已排队的请求，等待完成直到deadline(monotonic)，
+        剩余请求以错误结束，随后取消批处理循环与健康探测任务"""
+        self.draining = True
+        self.batch_event.set()
+        while self.load() and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+
+        dropped = self.queue.take(len(self.queue))
+        for req in dropped:
+            req.set_error("Service shutting down")
+        pending = {task for task in (self._task, self._health_task) if task is not None}
+        while pending:
+            # wait_for在内部等待恰好完成时可能吞掉取消，因此重复取消直到任务真正结束
+            for task in pending:
+                task.cancel()
+            _, pending = await asyncio.wait(pending, timeout=0.1)
+        if dropped or self.in_flight:
+            logger.warning(f"Drain deadline reached on {self.model_name}/{self.replica_id}: "
+                           f"{len(dropped)} queued and {self.in_flight} in-flight requests failed")
+
+    async def _run_batch(self, model: AIModelAdapter, current_batch: List[AIRequest], permit: int = 0):
+        """对一个批次执行推理并分配结果，结果按熔断许可permit记入熔断器"""
+        # 模型加载期间可能有调用方放弃，推理前再过滤一次
+        if any(req.cancelled for req in current_batch):
+            current_batch[:] = [req for req in current_batch if not req.cancelled]
+            if not current_batch:
+                return
+
+        # 准备输入数据
+        inputs = [req.data for req in current_batch]
+
+        # 执行批量推理
+        start_time = time.monotonic()
+        try:
+            results = await self._predict(model, inputs)
+        except Exception:
+            self.breaker.record(False, permit=permit)
+            raise
+        latency = time.monotonic() - start_time
+        self.breaker.record(True, latency, permit=permit)
+        self.sizer.observe(len(current_batch), latency)
+        self.batch_sizes[len(current_batch)] += 1
+        self._batch_size_metric.observe(len(current_batch))
+        self._model_latency_metric.observe(latency)
+
+        # 分配结果
+        for req, result in zip(current_batch, results):
+            req.set_result(AIResponse(
+                request_id=req.request_id,
+                result=result,
+                latency=latency
+            ))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Processed batch of {len(current_batch)} requests in {latency:.4f}s "
+                         f"on {self.model_name}/{self.replica_id} (next batch size: {self.batch_size})")
+
+    async def _predict(self, model: AIModelAdapter, inputs: List[Any]) -> List[Any]:
+        """执行推理；超过本副本p95延迟仍未返回时向另一副本发起对冲，取先完成者"""
+        hedge_after = None
+        if CONFIG["hedge_enabled"] and len(self.sizer.latencies) >= CONFIG["hedge_min_samples"]:
+            hedge_after = self.sizer.percentile(0.95)
+        backup = self.dispatcher.hedge_target(self) if hedge_after and self.dispatcher else None
+        if backup is None:
+            return await model.predict(inputs)
+
+        primary = asyncio.ensure_future(model.predict(inputs))
+        tasks = [primary]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+            if done:
+                return primary.result()
+
+            self.hedged += 1
+            secondary = asyncio.ensure_future(backup.hedge_predict(inputs))
+            tasks.append(secondary)
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is secondary:
+                            self.hedge_wins += 1
+                        return task.result()
+            raise primary.exception()
+        finally:
+            # 调用方被取消或一方已胜出时，取消并等待其余推理，避免重复推理在后台继续占用副本
+            leftovers = [task for task in tasks if not task.done()]
+            for task in leftovers:
+                task.cancel()
+            if leftovers:
+                await asyncio.gather(*leftovers, return_exceptions=True)
+
+    async def hedge_predict(self, inputs: List[Any]) -> List[Any]:
+        """作为对冲目标直接执行一次推理(不经过本副本队列)"""
+        async with ModelFactory.use(self.backend) as model:
+            start_time = time.monotonic()
             try:
-                # 准备输入数据
-                inputs = [req.data for req in current_batch]
+                results = await model.predict(inputs)
+            except Exception:
+                self.breaker.record(False)
+                raise
+            self.breaker.record(True, time.monotonic() - start_time)
+            return results
+
+    def load(self) -> int:
+        """排队与推理中的请求总数"""
+        return len(self.queue) + self.in_flight
+
+    def expected_wait(self) -> float:
+        """按EWMA推理延迟估算新请求需要等待的时间"""
+        batches = len(self.queue) / max(1, self.batch_size) + (1 if self.in_flight else 0)
+        return (batches + 1) * self.sizer.expected_latency
+
+
+class StreamingBatchProcessor(BatchProcessor):
+    """流式生成的连续批处理(continuous batching)
+
+    以解码步为单位调度：每一步对所有活跃序列各解码一次并立即推送分片，
+    结束的序列当步释放槽位，队列中的新请求在下一步加入，无需等整批完成。
+    模型侧只需实现init_stream与decode_step两个按步接口。
+    """
+
+    kind = "stream"
+
+    def __init__(self, model_name: str, replica_id: int = 0,
+                 breaker: Optional[CircuitBreaker] = None):
+        super().__init__(model_name, replica_id, breaker)
+        self.slots = CONFIG["stream_slots"]
+        self.aborted = 0  # 调用方放弃或超过截止时间而中止的序列数
+        self._aborted_metric = metrics.counter(
+            "ai_stream_aborted_total", "Streaming sequences aborted before completion", model=model_name)
+
+    @property
+    def batch_size(self) -> int:
+        """连续批处理按槽位数组批"""
+        return self.slots
 
-                # 执行批量推理
-                start_time = time.time()
-                results = await self.model.predict(inputs)
-                latency = time.time() - start_time
+    async def _process_batches(self):
+        """连续批处理核心逻辑"""
+        active: List[Tuple[AIRequest, Any]] = []
+        try:
+            await self._decode_loop(active)
+        except asyncio.CancelledError:
+            for req, _ in active:
+                req.set_error("Service shutting down")
+            raise
+
+    async def _decode_loop(self, active: List[Tuple[AIRequest, Any]]):
+        """按解码步循环，active为活跃序列(原地修改，供取消时结束未完成的序列)"""
+        while True:
+            if active:
+                admitted = self.queue.take(self.slots - len(active))
+            else:
+                admitted = await self._next_batch()
+
+            # 先登记再借用模型，取消发生在加载期间时也能结束这些序列
+            active.extend((req, None) for req in admitted)
+            now = time.monotonic()
+            active[:] = [(req, state) for req, state in active if not self._should_abort(req, now)]
+            self.in_flight = len(active)
+            if not active:
+                continue
+            try:
+                async with ModelFactory.use(self.backend) as model:
+                    active[:] = [(req, model.init_stream(req.data) if state is None else state)
+                                 for req, state in active]
+                    self.in_flight = len(active)
+                    self.batch_sizes[len(active)] += 1
+                    outputs = await model.decode_step([state for _, state in active])
+            except Exception as e:
+                logger.exception("Streaming batch step failed")
+                for req, _ in active:
+                    req.set_error(f"Processing error: {str(e)}")
+                active.clear()
+                self.in_flight = 0
+                continue
 
-                # 分配结果
-                for req, result in zip(current_batch, results):
-                    req.result = AIResponse(
+            still_active = []
+            for (req, state), (chunk, done) in zip(active, outputs):
+                req.push_chunk(chunk)
+                if done:
+                    req.set_result(AIResponse(
                         request_id=req.request_id,
-                        result=result,
-                        latency=latency
-                    )
-                logger.info(f"Processed batch of {len(current_batch)} requests in {latency:.4f}s")
+                        result=None,
+                        latency=time.monotonic() - req.enqueued_at
+                    ))
+                else:
+                    still_active.append((req, state))
+            active[:] = still_active
+            self.in_flight = len(active)
+
+    def _should_abort(self, request: AIRequest, now: float) -> bool:
+        """调用方已放弃或已过截止时间的序列不再解码，后者以错误结束"""
+        if not request.cancelled:
+            if request.deadline is None or request.deadline > now:
+                return False
+            request.set_error("Deadline exceeded")
+        self.aborted += 1
+        self._aborted_metric.inc()
+        return True
 
-            except Exception as e:
-                logger.exception("Batch processing failed")
-                for req in current_batch:
-                    req.error = f"Processing error: {str(e)}"
+
+# --- 多副本调度 ---
+class ReplicaDispatcher:
+    """同一模型的多个批处理副本，每个副本独立运行批处理循环，请求分发到最空闲的副本
+
+    shared模式下副本共用一个模型实例，只提高批处理并发：熔断与健康探测按实例共享，
+    也不做对冲(对冲到同一实例无法绕开变慢的后端)。dedicated模式下每个副本独立熔断与对冲。
+    """
+
+    def __init__(self, model_name: str, replicas: int = 1, policy: str = "least_loaded",
+                 processor_cls: type = BatchProcessor):
+        self.model_name = model_name
+        self.policy = policy
+        self.replicas = []
+        breakers: Dict[str, CircuitBreaker] = {}
+        for i in range(replicas):
+            replica = processor_cls(model_name, replica_id=i,
+                                    breaker=breakers.get(backend_key(model_name, i)))
+            breakers.setdefault(replica.backend, replica.breaker)
+            replica.dispatcher = self
+            self.replicas.append(replica)
+        self.dispatched = [0] * replicas
+
+    async def start_processing(self):
+        """启动所有副本的批处理循环，每个模型实例一个健康探测"""
+        probed = set()
+        for replica in self.replicas:
+            await replica.start_processing(health_probe=replica.backend not in probed)
+            probed.add(replica.backend)
+
+    def pick(self) -> BatchProcessor:
+        """按调度策略选择未熔断的副本，全部熔断时抛出CircuitOpenError"""
+        candidates = [r for r in self.replicas if r.breaker.available()]
+        if not candidates:
+            raise CircuitOpenError("Model unavailable (circuit open)")
+        if len(candidates) == 1:
+            return candidates[0]
+        if self.policy == "ewma_latency":
+            return min(candidates, key=lambda r: (r.expected_wait(), r.load()))
+        return min(candidates, key=lambda r: r.load())
+
+    def hedge_target(self, primary: BatchProcessor) -> Optional[BatchProcessor]:
+        """为对冲请求选择使用另一个模型实例的可用副本"""
+        candidates = [r for r in self.replicas
+                      if r.backend != primary.backend and r.breaker.state is CircuitState.CLOSED]
+        return min(candidates, key=lambda r: r.load()) if candidates else None
+
+    async def add_request(self, request: AIRequest):
+        """把请求加入所选副本的队列"""
+        replica = self.pick()
+        self.dispatched[replica.replica_id] += 1
+        await replica.add_request(request)
+
+    async def drain(self, deadline: float):
+        """并行排空所有副本"""
+        await asyncio.gather(*(replica.drain(deadline) for replica in self.replicas))
+
+    def queue_stats(self) -> Dict[str, Dict[str, Any]]:
+        """各副本的队列指标与分发数"""
+        return {
+            f"{self.model_name}/{replica.replica_id}": {
+                **replica.queue.stats(),
+                "dispatched": self.dispatched[replica.replica_id],
+                "batch_size": replica.batch_size,
+                "circuit": replica.breaker.state.value,
+                "circuit_trips": replica.breaker.trips,
+                "hedged": replica.hedged,
+                "hedge_wins": replica.hedge_wins,
+            }
+            for replica in self.replicas
+        }
+
+    def batch_size_histogram(self) -> Counter:
+        """所有副本合计的批大小分布"""
+        histogram = Counter()
+        for replica in self.replicas:
+            histogram.update(replica.batch_sizes)
+        return histogram
 
 
 # --- 缓存服务(策略模式) ---
-class PredictionCache:
-    """带TTL的预测缓存服务"""
+class EvictionPolicy(ABC):
+    """缓存淘汰策略接口"""
+
+    @abstractmethod
+    def on_insert(self, key: str):
+        pass
+
+    @abstractmethod
+    def on_access(self, key: str):
+        pass
+
+    @abstractmethod
+    def on_remove(self, key: str):
+        pass
+
+    @abstractmethod
+    def victim(self) -> str:
+        """选出下一个被淘汰的键"""
+        pass
+
+
+class LRUPolicy(EvictionPolicy):
+    """最近最少使用"""
+
+    def __init__(self, max_entries: int):
+        self.order: OrderedDict = OrderedDict()
+
+    def on_insert(self, key: str):
+        self.order[key] = None
+
+    def on_access(self, key: str):
+        self.order.move_to_end(key)
+
+    def on_remove(self, key: str):
+        self.order.pop(key, None)
+
+    def victim(self) -> str:
+        return next(iter(self.order))
+
+
+class LFUPolicy(EvictionPolicy):
+    """最不经常使用，按频次分桶实现O(1)操作，同频次内按LRU淘汰"""
+
+    def __init__(self, max_entries: int):
+        self.freq: Dict[str, int] = {}
+        self.buckets: Dict[int, OrderedDict] = {}
+        self.min_freq = 0
+
+    def _bucket_remove(self, key: str, freq: int):
+        bucket = self.buckets[freq]
+        del bucket[key]
+        if not bucket:
+            del self.buckets[freq]
+            if self.min_freq == freq:
+                self.min_freq = freq + 1
+
+    def on_insert(self, key: str):
+        self.freq[key] = 1
+        self.buckets.setdefault(1, OrderedDict())[key] = None
+        self.min_freq = 1
+
+    def on_access(self, key: str):
+        freq = self.freq[key]
+        self._bucket_remove(key, freq)
+        self.freq[key] = freq + 1
+        self.buckets.setdefault(freq + 1, OrderedDict())[key] = None
+
+    def on_remove(self, key: str):
+        freq = self.freq.pop(key, None)
+        if freq is not None:
+            self._bucket_remove(key, freq)
+            if not self.buckets:
+                self.min_freq = 0
+            elif self.min_freq not in self.buckets:
+                self.min_freq = min(self.buckets)
+
+    def victim(self) -> str:
+        return next(iter(self.buckets[self.min_freq]))
+
+
+class FrequencySketch:
+    """Count-Min Sketch频率估计，计数达到采样上限后整体减半以遗忘旧热点"""
+
+    SEEDS = (0x9E3779B1, 0x85EBCA77, 0xC2B2AE3D, 0x27D4EB2F)
+
+    def __init__(self, max_entries: int):
+        width = 1
+        while width < max(16, max_entries):
+            width <<= 1
+        self.mask = width - 1
+        self.rows = [[0] * width for _ in self.SEEDS]
+        self.sample_size = 10 * max(16, max_entries)
+        self.additions = 0
+
+    def _indexes(self, key: str):
+        h = hash(key)
+        return [((h ^ seed) * 0x01000193 >> 7) & self.mask for seed in self.SEEDS]
+
+    def increment(self, key: str):
+        for row, idx in zip(self.rows, self._indexes(key)):
+            if row[idx] < 15:
+                row[idx] += 1
+        self.additions += 1
+        if self.additions >= self.sample_size:
+            for row in self.rows:
+                for i, count in enumerate(row):
+                    row[i] = count >> 1
+            self.additions //= 2
+
+    def frequency(self, key: str) -> int:
+        return min(row[idx] for row, idx in zip(self.rows, self._indexes(key)))
+
+
+class WTinyLFUPolicy(EvictionPolicy):
+    """W-TinyLFU：1%的LRU窗口区 + 分段LRU主区(试用区/保护区)
+
+    新条目先进入窗口区，溢出后进入试用区尾部成为候选；淘汰时候选与试用区头部
+    比较历史频率，频率低者被淘汰，从而挡住一次性访问对热点的冲刷。
+    """
+
+    def __init__(self, max_entries: int):
+        self.window_size = max(1, max_entries // 100)
+        self.protected_size = max(1, (max_entries - self.window_size) * 4 // 5)
+        self.window: OrderedDict = OrderedDict()
+        self.probation: OrderedDict = OrderedDict()
+        self.protected: OrderedDict = OrderedDict()
+        self.sketch = FrequencySketch(max_entries)
+        self._candidate: Optional[str] = None
+
+    def on_insert(self, key: str):
+        self.sketch.increment(key)
+        self.window[key] = None
+        if len(self.window) > self.window_size:
+            candidate, _ = self.window.popitem(last=False)
+            self.probation[candidate] = None
+            self._candidate = candidate
+
+    def on_access(self, key: str):
+        self.sketch.increment(key)
+        if key in self.window:
+            self.window.move_to_end(key)
+        elif key in self.probation:
+            del self.probation[key]
+            self.protected[key] = None
+            if len(self.protected) > self.protected_size:
+                demoted, _ = self.protected.popitem(last=False)
+                self.probation[demoted] = None
+        else:
+            self.protected.move_to_end(key)
+
+    def on_remove(self, key: str):
+        for segment in (self.window, self.probation, self.protected):
+            if key in segment:
+                del segment[key]
+                break
+        if self._candidate == key:
+            self._candidate = None
+
+    def victim(self) -> str:
+        if self.probation:
+            head = next(iter(self.probation))
+            candidate = self._candidate
+            if candidate is not None and candidate != head and candidate in self.probation:
+                if self.sketch.frequency(candidate) <= self.sketch.frequency(head):
+                    return candidate
+            return head
+        if self.protected:
+            return next(iter(self.protected))
+        return next(iter(self.window))
+
+
+EVICTION_POLICIES = {
+    "lru": LRUPolicy,
+    "lfu": LFUPolicy,
+    "tinylfu": WTinyLFUPolicy,
+}
+
+
+def estimate_size(value: Any, depth: int = 2) -> int:
+    """粗略估算对象占用的字节数(递归展开容器)"""
+    size = sys.getsizeof(value)
+    if depth <= 0:
+        return size
+    if isinstance(value, dict):
+        size += sum(estimate_size(k, depth - 1) + estimate_size(v, depth - 1) for k, v in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(estimate_size(item, depth - 1) for item in value)
+    elif hasattr(value, "__dict__"):
+        size += estimate_size(vars(value), depth - 1)
+    return size
+
+
+class CacheBackend(ABC):
+    """缓存存储后端接口，get未命中或已过期时返回None"""
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[Any]:
+        pass
+
+    @abstractmethod
+    async def set(self, key: str, value: Any):
+        pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {}
+
+    async def close(self):
+        pass
 
-    def __init__(self, ttl: int = 300):
-        self.cache = {}
+
+class MemoryCacheBackend(CacheBackend):
+    """进程内有界缓存
+
+    条目数与估算内存同时受限，超限时按淘汰策略逐出；后台任务定期清理过期条目。
+    """
+
+    def __init__(self, ttl: int = 300, policy: str = "lru", max_entries: int = 10000,
+                 max_bytes: int = 64 * 1024 * 1024, sweep_interval: float = 5.0):
+        self.cache: Dict[str, tuple] = {}  # key -> (value, expires_at, size)
         self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sweep_interval = sweep_interval
+        self.policy: EvictionPolicy = EVICTION_POLICIES[policy](max_entries)
+        self._expiry: OrderedDict = OrderedDict()  # TTL固定，写入顺序即过期顺序
+        self._sweeper: Optional[asyncio.Task] = None
+        self.bytes = 0
+        self.evictions = 0
+        self.expirations = 0
 
     async def get(self, key: str) -> Optional[Any]:
         """获取缓存结果"""
-        if key in self.cache:
-            result, timestamp = self.cache[key]
-            if time.time() - timestamp < self.ttl:
-                return result
+        entry = self.cache.get(key)
+        if entry is not None:
+            value, expires_at, _ = entry
+            if time.monotonic() < expires_at:
+                self.policy.on_access(key)
+                return value
             # 缓存过期
-            del self.cache[key]
+            self._remove(key)
+            self.expirations += 1
         return None
 
+    async def set(self, key: str, value: Any):
+        """设置缓存，超出条目数或内存预算时淘汰旧条目"""
+        if self._sweeper is None:
+            self._sweeper = asyncio.create_task(self._sweep_loop())
+
+        size = estimate_size(key) + estimate_size(value)
+        if size > self.max_bytes:
+            return  # 单条结果超过整个预算，不缓存
+        if key in self.cache:
+            self._remove(key)
+
+        self.cache[key] = (value, time.monotonic() + self.ttl, size)
+        self._expiry[key] = None
+        self.bytes += size
+        self.policy.on_insert(key)
+
+        while len(self.cache) > self.max_entries or self.bytes > self.max_bytes:
+            self._remove(self.policy.victim())
+            self.evictions += 1
+
+    def _remove(self, key: str):
+        _, _, size = self.cache.pop(key)
+        del self._expiry[key]
+        self.bytes -= size
+        self.policy.on_remove(key)
+
+    def sweep(self) -> int:
+        """清理所有已过期条目，返回清理数量"""
+        now = time.monotonic()
+        removed = 0
+        while self._expiry:
+            key = next(iter(self._expiry))
+            if self.cache[key][1] > now:
+                break
+            self._remove(key)
+            removed += 1
+        self.expirations += removed
+        return removed
+
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            self.sweep()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self.cache),
+            "bytes": self.bytes,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+    async def close(self):
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            self._sweeper = None
+
+
+class SQLiteCacheBackend(CacheBackend):
+    """基于SQLite(WAL模式)的共享缓存，同一主机上的多个worker进程共用一个文件
+
+    过期时间使用墙钟(time.time)以便跨进程比较；数据库调用在单独线程中串行执行，
+    不阻塞事件循环。值以pickle存储，缓存文件只应由本服务的进程读写。
+    数据库错误(锁超时、磁盘已满、文件损坏等)只记录日志：读取按未命中处理，写入与清理直接跳过。
+    """
+
+    def __init__(self, path: str, ttl: int = 300, max_entries: int = 100000,
+                 sweep_interval: float = 5.0):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.sweep_interval = sweep_interval
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite-cache")
+        self._conn: Optional[sqlite3.Connection] = None
+        self._sweeper: Optional[asyncio.Task] = None
+        self.evictions = 0
+        self.expirations = 0
+        self.errors = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None,
+                                   check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS prediction_cache ("
+                "key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_prediction_cache_expires "
+                "ON prediction_cache (expires_at)"
+            )
+            self._conn = conn
+        return self._conn
+
+    async def _run(self, fn: Callable, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, fn, *args)
+
+    async def _try_run(self, op: str, fn: Callable, *args) -> Optional[Any]:
+        """执行数据库调用，sqlite3.Error记录日志后返回None"""
+        try:
+            return await self._run(fn, *args)
+        except sqlite3.Error as e:
+            self.errors += 1
+            logger.warning(f"SQLite cache {op} failed ({self.path}): {e}")
+            return None
+
+    def _get(self, key: str) -> Optional[Any]:
+        row = self._connect().execute(
+            "SELECT value FROM prediction_cache WHERE key = ? AND expires_at > ?",
+            (key, time.time()),
+        ).fetchone()
+        return pickle.loads(row[0]) if row else None
+
+    def _set(self, key: str, value: Any):
+        self._connect().execute(
+            "INSERT OR REPLACE INTO prediction_cache (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), time.time() + self.ttl),
+        )
+
+    def _sweep(self):
+        conn = self._connect()
+        expired = conn.execute(
+            "DELETE FROM prediction_cache WHERE expires_at <= ?", (time.time(),)
+        ).rowcount
+        # 超出条目上限时按过期时间从早到晚淘汰
+        overflow = conn.execute("SELECT COUNT(*) FROM prediction_cache").fetchone()[0] - self.max_entries
+        evicted = 0
+        if overflow > 0:
+            evicted = conn.execute(
+                "DELETE FROM prediction_cache WHERE key IN ("
+                "SELECT key FROM prediction_cache ORDER BY expires_at LIMIT ?)",
+                (overflow,),
+            ).rowcount
+        self.expirations += expired
+        self.evictions += evicted
+
+    async def get(self, key: str) -> Optional[Any]:
+        return await self._try_run("get", self._get, key)
+
+    async def set(self, key: str, value: Any):
+        if self._sweeper is None:
+            self._sweeper = asyncio.create_task(self._sweep_loop())
+        await self._try_run("set", self._set, key, value)
+
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            await self._try_run("sweep", self._sweep)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": "sqlite",
+            "path": self.path,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "errors": self.errors,
+        }
+
+    async def close(self):
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            self._sweeper = None
+        if self._conn is not None:
+            await self._run(self._conn.close)
+            self._conn = None
+        self._executor.shutdown(wait=False)
+
+
+def build_cache_backend() -> CacheBackend:
+    """按CONFIG创建缓存后端"""
+    if CONFIG["cache_backend"] == "sqlite":
+        return SQLiteCacheBackend(
+            path=CONFIG["cache_path"],
+            ttl=CONFIG["cache_ttl"],
+            max_entries=CONFIG["cache_max_entries"],
+            sweep_interval=CONFIG["cache_sweep_interval"],
+        )
+    return MemoryCacheBackend(
+        ttl=CONFIG["cache_ttl"],
+        policy=CONFIG["cache_policy"],
+        max_entries=CONFIG["cache_max_entries"],
+        max_bytes=CONFIG["cache_max_bytes"],
+        sweep_interval=CONFIG["cache_sweep_interval"],
+    )
+
+
+class PredictionCache:
+    """带TTL的预测缓存服务，存储委托给可替换的后端，并统计本进程的命中率"""
+
+    def __init__(self, backend: Optional[CacheBackend] = None):
+        self.backend = backend or MemoryCacheBackend()
+        self.hits = 0
+        self.misses = 0
+        self._hit_metric = metrics.counter("ai_cache_requests_total", "Prediction cache lookups",
+                                           result="hit")
+        self._miss_metric = metrics.counter("ai_cache_requests_total", "Prediction cache lookups",
+                                            result="miss")
+
+    async def get(self, key: str) -> Optional[Any]:
+        """获取缓存结果"""
+        value = await self.backend.get(key)
+        if value is None:
+            self.misses += 1
+            self._miss_metric.inc()
+        else:
+            self.hits += 1
+            self._hit_metric.inc()
+        return value
+
     async def set(self, key: str, value: Any):
         """设置缓存"""
-        self.cache[key] = (value, time.time())
+        await self.backend.set(key, value)
+
+    async def close(self):
+        await self.backend.close()
+
+    def stats(self) -> Dict[str, Any]:
+        """命中、淘汰与内存占用指标"""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            **self.backend.stats(),
+        }
+
+
+# --- 语义缓存(近似重复输入) ---
+SEMANTIC_STOPWORDS = frozenset(
+    "a an the please could would can you me i to of for and or is are what how do does".split())
+
+
+def char_ngram_embedding(data: Any, dim: int) -> List[float]:
+    """本地文本嵌入：规范化后的词与字符三元组做带符号哈希，L2归一化
+
+    不依赖外部模型；去掉大小写、标点和常见客套词，使改写后的同义问题得到相同或相近的向量。
+    """
+    words = [w for w in re.findall(r"\w+", str(data).lower()) if w not in SEMANTIC_STOPWORDS]
+    vector = [0.0] * dim
+    features = [(w, 1.0) for w in words]
+    text = " ".join(words)
+    features += [(text[i:i + 3], 0.5) for i in range(len(text) - 2)]
+    for feature, weight in features:
+        h = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+        vector[h % dim] += weight if h >> 63 else -weight
+    norm = math.sqrt(sum(v * v for v in vector))
+    return [v / norm for v in vector] if norm else vector
+
+
+SEMANTIC_EMBEDDERS: Dict[str, Callable[[Any, int], List[float]]] = {
+    "char_ngram": char_ngram_embedding,
+}
+
+
+class SimilarityIndex:
+    """随机超平面LSH近似最近邻索引(余弦相似度)，只保留最近插入的max_entries个向量
+
+    每张表把向量投影到bits个随机超平面得到桶号，查询时取各表同桶的候选再精确计算相似度。
+    """
+
+    def __init__(self, dim: int, max_entries: int, tables: int = 4, bits: int = 12, seed: int = 0):
+        rng = random.Random(seed)
+        self.max_entries = max_entries
+        self._planes = [[[rng.gauss(0, 1) for _ in range(dim)] for _ in range(bits)] for _ in range(tables)]
+        self._buckets: List[Dict[int, set]] = [{} for _ in range(tables)]
+        self._entries: "OrderedDict[int, Tuple[List[Tuple[int, float]], List[int], Any]]" = OrderedDict()
+        self._next_id = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def _sparse(vector: List[float]) -> List[Tuple[int, float]]:
+        return [(i, v) for i, v in enumerate(vector) if v]
+
+    def _signatures(self, sparse: List[Tuple[int, float]]) -> List[int]:
+        signatures = []
+        for planes in self._planes:
+            signature = 0
+            for plane in planes:
+                signature = (signature << 1) | (sum(plane[i] * v for i, v in sparse) >= 0)
+            signatures.append(signature)
+        return signatures
+
+    def add(self, vector: List[float], value: Any) -> int:
+        """插入向量，超出容量时移除最早插入的条目，返回条目id"""
+        sparse = self._sparse(vector)
+        signatures = self._signatures(sparse)
+        entry_id = self._next_id
+        self._next_id += 1
+        self._entries[entry_id] = (sparse, signatures, value)
+        for buckets, signature in zip(self._buckets, signatures):
+            buckets.setdefault(signature, set()).add(entry_id)
+        while len(self._entries) > self.max_entries:
+            self.remove(next(iter(self._entries)))
+        return entry_id
+
+    def remove(self, entry_id: int):
+        entry = self._entries.pop(entry_id, None)
+        if entry is None:
+            return
+        for buckets, signature in zip(self._buckets, entry[1]):
+            bucket = buckets[signature]
+            bucket.discard(entry_id)
+            if not bucket:
+                del buckets[signature]
+
+    def search(self, vector: List[float]) -> Optional[Tuple[int, float, Any]]:
+        """返回候选中相似度最高的(条目id, 相似度, 值)，没有候选时返回None"""
+        sparse = self._sparse(vector)
+        candidates = set()
+        for buckets, signature in zip(self._buckets, self._signatures(sparse)):
+            candidates |= buckets.get(signature, set())
+        best = None
+        query = dict(sparse)
+        for entry_id in candidates:
+            entry_sparse, _, value = self._entries[entry_id]
+            similarity = sum(query.get(i, 0.0) * v for i, v in entry_sparse)
+            if best is None or similarity > best[1]:
+                best = (entry_id, similarity, value)
+        return best
+
+
+@dataclass(slots=True)
+class SemanticHit:
+    entry_id: int
+    similarity: float
+    result: Any
+
+
+class SemanticCache:
+    """语义缓存层：精确缓存未命中时，在相似输入的索引中查找，相似度达到阈值即复用其结果
+
+    按模型开启。命中按verify_rate抽样在后台重新推理，结果不一致计为误命中并移除该条目；
+    只有输出确定的模型(适配器deterministic为True)才做校验，否则误命中统计没有意义。
+    """
+
+    def __init__(self, model_name: str, threshold: Optional[float] = None, embedder: Optional[str] = None,
+                 dim: Optional[int] = None, max_entries: Optional[int] = None,
+                 verify_rate: Optional[float] = None, ttl: Optional[float] = None,
+                 equivalent: Callable[[Any, Any], bool] = lambda a, b: a == b):
+        self.model_name = model_name
+        self.threshold = CONFIG["semantic_cache_threshold"] if threshold is None else threshold
+        self.dim = dim or CONFIG["semantic_cache_dim"]
+        self.embedder = SEMANTIC_EMBEDDERS[embedder or CONFIG["semantic_cache_embedder"]]
+        self.verify_rate = CONFIG["semantic_cache_verify_rate"] if verify_rate is None else verify_rate
+        self.ttl = CONFIG["cache_ttl"] if ttl is None else ttl
+        self.equivalent = equivalent
+        self.index = SimilarityIndex(self.dim, max_entries or CONFIG["semantic_cache_max_entries"])
+        self.hits = 0
+        self.misses = 0
+        self.verified = 0
+        self.false_hits = 0
+        self._metrics = {
+            result: metrics.counter("ai_semantic_cache_requests_total", "Semantic cache lookups",
+                                    model=model_name, result=result)
+            for result in ("hit", "miss", "false_hit")
+        }
+
+    def embed(self, data: Any) -> List[float]:
+        return self.embedder(data, self.dim)
+
+    def lookup(self, vector: List[float]) -> Optional[SemanticHit]:
+        """查找相似度不低于阈值且未过期的历史结果"""
+        match = self.index.search(vector)
+        if match is not None:
+            entry_id, similarity, (result, expires_at) = match
+            if expires_at <= time.monotonic():
+                self.index.remove(entry_id)
+            elif similarity >= self.threshold:
+                self.hits += 1
+                self._metrics["hit"].inc()
+                return SemanticHit(entry_id, similarity, result)
+        self.misses += 1
+        self._metrics["miss"].inc()
+        return None
+
+    def add(self, vector: List[float], result: Any):
+        self.index.add(vector, (result, time.monotonic() + self.ttl))
+
+    def should_verify(self) -> bool:
+        return self.verify_rate > 0 and random.random() < self.verify_rate
+
+    def record_verification(self, hit: SemanticHit, actual: Any):
+        """记录一次后台校验，结果与缓存不一致时计为误命中并移除条目"""
+        self.verified += 1
+        if not self.equivalent(hit.result, actual):
+            self.false_hits += 1
+            self._metrics["false_hit"].inc()
+            self.index.remove(hit.entry_id)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "verified": self.verified,
+            "false_hits": self.false_hits,
+            "false_hit_ratio": self.false_hits / self.verified if self.verified else 0.0,
+            "entries": len(self.index),
+        }
+
+
+# --- 请求合并(single-flight) ---
+class SingleFlight:
+    """相同键的在途请求只执行一次，后到的重复请求共享同一个Future
+
+    记录每个键的等待方数量，所有等待方都放弃(超时或取消)时取消在途请求。
+    """
+
+    def __init__(self):
+        self.calls: Dict[str, AIRequest] = {}  # 键 -> 实际进入批处理的请求
+        self.waiters: Dict[str, int] = {}
+        self.coalesced = 0  # 被合并(未进入批处理)的请求数
+
+    def join(self, key: str, deadline: Optional[float] = None) -> Optional[asyncio.Future]:
+        """返回该键在途请求的Future，没有(或已结束)则返回None；合并后的请求截止时间取最晚的等待方"""
+        leader = self.calls.get(key)
+        if leader is None or leader.future.done():
+            return None  # 已结束但完成回调尚未执行时，由本请求重新发起
+        self.coalesced += 1
+        self.waiters[key] += 1
+        if deadline is not None and leader.deadline is not None and deadline > leader.deadline:
+            leader.deadline = deadline
+        return leader.future
+
+    def register(self, key: str, request: AIRequest):
+        """登记在途请求(需已绑定Future)，完成后自动移除"""
+        self.calls[key] = request
+        self.waiters[key] = 1
+        future = request.future
+        future.add_done_callback(lambda f: self._release(key, f))
+
+    def leave(self, key: str):
+        """一个等待方放弃，最后一个等待方放弃时取消在途请求"""
+        leader = self.calls.get(key)
+        if leader is None:
+            return
+        self.waiters[key] -= 1
+        if self.waiters[key] <= 0:
+            # 先同步移除再取消，之后到达的相同请求不会再合并到已取消的Future上
+            del self.calls[key]
+            del self.waiters[key]
+            leader.cancel()
+
+    def _release(self, key: str, future: asyncio.Future):
+        leader = self.calls.get(key)
+        if leader is not None and leader.future is future:
+            del self.calls[key]
+            del self.waiters[key]
+        if not future.cancelled():
+            future.exception()  # 标记异常已被读取，避免无等待方时告警
 
 
 # --- 限流系统(责任链模式) ---
-class RateLimiter:
-    """令牌桶限流算法实现"""
+class TokenBucket:
+    """单个令牌桶，按单调时钟惰性补充令牌"""
 
-    def __init__(self, capacity: int, refill_rate: float):
+    __slots__ = ("capacity", "refill_rate", "tokens", "last_refill")
+
+    def __init__(self, capacity: float, refill_rate: float, now: float):
         self.capacity = capacity  # 令牌桶容量
-        self.tokens = capacity  # 当前令牌数量
         self.refill_rate = refill_rate  # 每秒补充速率(令牌/秒)
-        self.last_refill = time.time()
-        self.lock = asyncio.Lock()
-
-    async def acquire(self) -> bool:
-        """获取一个令牌，成功返回True"""
-        async with self.lock:
-            # 补充令牌
-            current_time = time.time()
-            time_elapsed = current_time - self.last_refill
-            tokens_to_add = time_elapsed * self.refill_rate
-
-            if tokens_to_add > 0:
-                self.tokens = min(self.capacity, self.tokens + tokens_to_add)
-                self.last_refill = current_time
-
-            # 检查令牌
-            if self.tokens >= 1:
-                self.tokens -= 1
-                return True
+        self.tokens = capacity  # 当前令牌数量，负数表示已被预约的未来令牌
+        self.last_refill = now
+
+    def refill(self, now: float):
+        """补充自上次以来累积的令牌"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.refill_rate)
+        self.last_refill = now
+
+
+class RateLimiter:
+    """按键(租户/API Key/模型)分片的令牌桶限流算法实现
+
+    每个键独立一个令牌桶，补充在访问时按时间差惰性计算，单次调用O(1)。
+    事件循环单线程执行且检查与扣减之间没有await，因此无需全局锁。
+    键数量超过max_keys时淘汰最久未访问且已回满的令牌桶；未回满的桶若被淘汰，
+    重建时会拿到满额令牌，因此保留，此时键数量暂时超出max_keys。
+    """
+
+    EVICT_SCAN = 16  # 每次淘汰最多检查的最久未访问令牌桶数量
+
+    def __init__(self, capacity: int, refill_rate: float,
+                 quotas: Optional[Dict[str, tuple]] = None, max_keys: int = 10000):
+        self.capacity = capacity  # 默认令牌桶容量
+        self.refill_rate = refill_rate  # 默认补充速率(令牌/秒)
+        self.quotas = quotas or {}  # 键 -> (容量, 补充速率)，覆盖默认配额
+        self.max_keys = max_keys
+        self.buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()  # 按最近访问排序
+
+    def _bucket(self, key: str, now: float) -> TokenBucket:
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            if len(self.buckets) >= self.max_keys:
+                self._evict(now)
+            capacity, refill_rate = self.quotas.get(key, (self.capacity, self.refill_rate))
+            bucket = self.buckets[key] = TokenBucket(capacity, refill_rate, now)
+        else:
+            self.buckets.move_to_end(key)
+            bucket.refill(now)
+        return bucket
+
+    def _evict(self, now: float):
+        """从最久未访问的令牌桶中淘汰已回满的，直到键数量回到max_keys以下"""
+        for key in list(islice(self.buckets, self.EVICT_SCAN)):
+            bucket = self.buckets[key]
+            bucket.refill(now)
+            if bucket.tokens >= bucket.capacity:
+                del self.buckets[key]
+                if len(self.buckets) < self.max_keys:
+                    return
+
+    def try_acquire(self, key: str = "default") -> bool:
+        """非阻塞获取一个令牌，成功返回True"""
+        bucket = self._bucket(key, time.monotonic())
+        if bucket.tokens >= 1:
+            bucket.tokens -= 1
+            return True
+        return False
+
+    async def acquire(self, key: str = "default", timeout: float = 0.0) -> bool:
+        """获取一个令牌，令牌不足时最多等待timeout秒，成功返回True
+
+        等待方先预约令牌(令牌数可为负)再睡眠到该令牌补充完成，按到达顺序公平放行；
+        等待期间被取消时归还预约的令牌。
+        """
+        bucket = self._bucket(key, time.monotonic())
+        if bucket.tokens >= 1:
+            bucket.tokens -= 1
+            return True
+
+        wait = (1 - bucket.tokens) / bucket.refill_rate if bucket.refill_rate > 0 else float("inf")
+        if wait > timeout:
             return False
+        bucket.tokens -= 1
+        try:
+            await asyncio.sleep(wait)
+        except asyncio.CancelledError:
+            bucket.tokens = min(bucket.capacity, bucket.tokens + 1)
+            raise
+        return True
 
 
 # --- API服务核心 ---
@@ -225,143 +2637,560 @@ class AIService:
     """AI后端服务核心"""
 
     def __init__(self):
-        # 初始化各个组件
-        self.rate_limiter = RateLimiter(
+        # 初始化各个组件(rate_limiter为None时不限流)
+        self.rate_limiter: Optional[RateLimiter] = RateLimiter(
             capacity=CONFIG["max_concurrent"],
-            refill_rate=CONFIG["max_concurrent"] / 10  # 每秒补充10%容量
+            refill_rate=CONFIG["max_concurrent"] / 10,  # 每秒补充10%容量
+            quotas=CONFIG["tenant_quotas"],
         )
-        self.cache = PredictionCache(ttl=300)
+        self.cache = PredictionCache(build_cache_backend())
+        self.semantic_caches = {name: SemanticCache(name, **options)
+                                for name, options in CONFIG["semantic_cache_models"].items()}
+        self._background: set = set()  # 后台任务(语义缓存校验)，保持引用直到完成
+        self.single_flight = SingleFlight()
         self.processors = {}
+        self.stream_processors = {}
+        self.metrics_server: Optional[MetricsServer] = None
+        self.accepting = True  # 停机时置为False，新请求被直接拒绝
+        self._rate_limited_metric = metrics.counter(
+            "ai_rate_limited_total", "Requests rejected by the rate limiter")
+        self._request_metrics: Dict[str, tuple] = {}  # 模型名 -> 端点的(按状态的计数, 延迟)指标
         logger.info("AI Service initialized")
 
-    def get_processor(self, model_name: str) -> BatchProcessor:
+    def get_processor(self, model_name: str) -> ReplicaDispatcher:
         """获取模型处理器(工厂方法)"""
         if model_name not in self.processors:
-            processor = BatchProcessor(model_name)
+            processor = ReplicaDispatcher(
+                model_name,
+                replicas=CONFIG["replicas"].get(model_name, CONFIG["default_replicas"]),
+                policy=CONFIG["dispatch_policy"],
+            )
             asyncio.create_task(processor.start_processing())
             self.processors[model_name] = processor
         return self.processors[model_name]
 
+    def request_metrics(self, model_name: str) -> tuple:
+        """端点的({状态: 请求计数}, 端到端延迟)指标，每个模型只在首次请求时解析一次"""
+        resolved = self._request_metrics.get(model_name)
+        if resolved is None:
+            resolved = self._request_metrics[model_name] = (
+                {status: metrics.counter("ai_requests_total", "Requests handled by the inference endpoint",
+                                         model=model_name, status=status)
+                 for status in ("ok", "error")},
+                metrics.histogram("ai_request_latency_seconds", "End-to-end request latency",
+                                  model=model_name),
+            )
+        return resolved
+
+    def get_stream_processor(self, model_name: str) -> ReplicaDispatcher:
+        """获取流式生成处理器(连续批处理)"""
+        if model_name not in self.stream_processors:
+            processor = ReplicaDispatcher(
+                model_name,
+                replicas=CONFIG["replicas"].get(model_name, CONFIG["default_replicas"]),
+                policy=CONFIG["dispatch_policy"],
+                processor_cls=StreamingBatchProcessor,
+            )
+            asyncio.create_task(processor.start_processing())
+            self.stream_processors[model_name] = processor
+        return self.stream_processors[model_name]
+
+    def queue_stats(self) -> Dict[str, Dict[str, Any]]:
+        """各模型副本入口队列的深度与排队时间指标"""
+        stats = {}
+        for processor in self.processors.values():
+            stats.update(processor.queue_stats())
+        return stats
+
+    def batch_size_histogram(self) -> Dict[int, int]:
+        """所有模型合计的批大小分布"""
+        histogram = Counter()
+        for processor in self.processors.values():
+            histogram.update(processor.batch_size_histogram())
+        return dict(sorted(histogram.items()))
+
     async def process_request(self, request: AIRequest, model_name: str = "default") -> AIResponse:
         """处理单个AI请求(核心方法)"""
-        start_time = time.time()
+        start_time = time.monotonic()
+
+        if not self.accepting:
+            return AIResponse(
+                request_id=request.request_id,
+                result=None,
+                latency=0.0,
+                error="Service shutting down"
+            )
 
         # 1. 限流检查
-        if not await self.rate_limiter.acquire():
+        if (self.rate_limiter is not None
+                and not await self.rate_limiter.acquire(request.tenant, timeout=CONFIG["rate_limit_wait"])):
+            self._rate_limited_metric.inc()
             request.error = "Rate limit exceeded"
             return AIResponse(
                 request_id=request.request_id,
                 result=None,
-                latency=time.time() - start_time,
+                latency=time.monotonic() - start_time,
                 error="Rate limit exceeded"
             )
 
         # 2. 缓存检查
         cache_key = f"{model_name}:{request.data}"
-        if cached_result := await self.cache.get(cache_key):
-            logger.info(f"Cache hit for request {request.request_id}")
+        if (cached_result := await self.cache.get(cache_key)) is not None:
+            if should_log_request():
+                logger.info(f"Cache hit for request {request.request_id}")
             return AIResponse(
                 request_id=request.request_id,
                 result=cached_result,
-                latency=0.001,
-                processed_at=time.time()
+                latency=time.monotonic() - start_time,
+                cached=True
             )
 
-        # 3. 添加到批处理队列
-        processor = self.get_processor(model_name)
-        await processor.add_request(request)
-
-        # 4. 等待结果(带超时)
+        # 2b. 语义缓存：改写后的近似重复输入复用历史结果
+        semantic = self.semantic_caches.get(model_name)
+        embedding = None
+        if semantic is not None:
+            embedding = semantic.embed(request.data)
+            if (hit := semantic.lookup(embedding)) is not None:
+                if semantic.should_verify() and model_adapter_type(model_name).deterministic:
+                    self._spawn(self._verify_semantic_hit(semantic, hit, request.data, model_name))
+                return AIResponse(
+                    request_id=request.request_id,
+                    result=hit.result,
+                    latency=time.monotonic() - start_time,
+                    cached=True,
+                    similarity=hit.similarity
+                )
+
+        if request.deadline is None:
+            request.deadline = time.monotonic() + CONFIG["request_timeout"]
+
+        # 3. 相同输入已在途时直接共享其结果，否则添加到批处理队列
+        future = self.single_flight.join(cache_key, request.deadline)
+        is_leader = future is None
+        if is_leader:
+            processor = self.get_processor(model_name)
+            future = request.attach_future()
+            self.single_flight.register(cache_key, request)
+            try:
+                await processor.add_request(request)
+            except AIRequestError as e:  # 队列已满、所有副本熔断或服务停机
+                request.set_error(str(e))  # 同时唤醒已合并到本请求的等待方
+                return AIResponse(
+                    request_id=request.request_id,
+                    result=None,
+                    latency=time.monotonic() - start_time,
+                    error=request.error
+                )
+
+        # 4. 等待结果(带超时)，批处理循环完成后直接唤醒本协程
         try:
-            await asyncio.wait_for(
-                asyncio.shield(request.result),
-                timeout=10.0
-            )
+            timeout = max(0.0, request.deadline - time.monotonic())
+            response = await asyncio.wait_for(asyncio.shield(future), timeout=timeout)
+            if not is_leader:
+                request.result = AIResponse(
+                    request_id=request.request_id,
+                    result=response.result,
+                    latency=response.latency
+                )
         except asyncio.TimeoutError:
             request.error = "Processing timeout"
+            self.single_flight.leave(cache_key)  # 无人再等待时请求在组批前被丢弃
+        except asyncio.CancelledError:
+            self.single_flight.leave(cache_key)
+            raise
+        except AIRequestError as e:
+            request.error = str(e)
 
         # 5. 缓存结果
-        if request.result and not request.error:
-            await self.cache.set(cache_key, request.result)
+        if is_leader and request.result and not request.error:
+            await self.cache.set(cache_key, request.result.result)
+            if semantic is not None:
+                semantic.add(embedding, request.result.result)
 
         return request.result or AIResponse(
             request_id=request.request_id,
             result=None,
-            latency=time.time() - start_time,
+            latency=time.monotonic() - start_time,
             error=request.error or "Unknown error"
         )
 
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def _verify_semantic_hit(self, semantic: SemanticCache, hit: SemanticHit, data: Any,
+                                   model_name: str):
+        """以BULK优先级重新推理一次被语义命中的输入，核对缓存结果"""
+        shadow = AIRequest(request_id=f"verify-{hit.entry_id}", data=data, priority=Priority.BULK)
+        shadow.deadline = time.monotonic() + CONFIG["request_timeout"]
+        try:
+            await self.get_processor(model_name).add_request(shadow)
+            response = await shadow.future
+        except AIRequestError:
+            return  # 校验失败(队列满、停机等)不计入统计
+        semantic.record_verification(hit, response.result)
+
+    def semantic_stats(self) -> Dict[str, Dict[str, Any]]:
+        """各模型语义缓存的命中与误命中统计，verify为False表示模型输出不确定、未做校验"""
+        return {name: {**cache.stats(), "verify": model_adapter_type(name).deterministic}
+                for name, cache in self.semantic_caches.items()}
+
+    async def stream_request(self, request: AIRequest,
+                             model_name: str = "default") -> AsyncGenerator[str, None]:
+        """流式处理单个AI请求，模型每解码出一个分片就立即产出
+
+        失败(停机、限流、队列满、超时、推理异常)时抛出AIRequestError。
+        """
+        if not self.accepting:
+            raise ServiceShuttingDownError("Service shutting down")
+        if (self.rate_limiter is not None
+                and not await self.rate_limiter.acquire(request.tenant, timeout=CONFIG["rate_limit_wait"])):
+            self._rate_limited_metric.inc()
+            raise AIRequestError("Rate limit exceeded")
+
+        if request.deadline is None:
+            request.deadline = time.monotonic() + CONFIG["request_timeout"]
+        stream = request.stream = asyncio.Queue()
+        future = request.attach_future()
+        await self.get_stream_processor(model_name).add_request(request)
+
+        try:
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(stream.get(),
+                                                   timeout=max(0.0, request.deadline - time.monotonic()))
+                except asyncio.TimeoutError:
+                    request.error = "Processing timeout"
+                    raise AIRequestError(request.error)
+                if chunk is None:
+                    break
+                yield chunk
+        finally:
+            # 超时或调用方停止迭代(断开连接)时中止序列，释放解码槽位
+            if not future.done():
+                request.cancel()
+
+        if future.done() and not future.cancelled() and future.exception() is not None:
+            raise future.exception()
+
+    async def drain(self, timeout: float):
+        """停止接收新请求，在timeout秒内处理完已排队与推理中的请求，并停止批处理循环"""
+        self.accepting = False
+        deadline = time.monotonic() + timeout
+        dispatchers = list(self.processors.values()) + list(self.stream_processors.values())
+        await asyncio.gather(*(dispatcher.drain(deadline) for dispatcher in dispatchers))
+
     @asynccontextmanager
     async def lifespan(self):
-        """应用生命周期管理"""
+        """应用生命周期管理，退出时优雅停机"""
         logger.info("Starting AI service...")
-        yield
-        logger.info("Shutting down AI service...")
+        if CONFIG["metrics_port"]:
+            self.metrics_server = MetricsServer(metrics, port=CONFIG["metrics_port"])
+            await self.metrics_server.start()
+        try:
+            await ModelFactory.preload(CONFIG["preload_models"])
+            yield
+        finally:
+            # 应用异常退出时同样排空并释放进程池、共享内存等资源
+            logger.info("Shutting down AI service...")
+            await self.drain(CONFIG["drain_timeout"])
+            await ModelFactory.unload_all()
+            await self.cache.close()
+            if self.metrics_server is not None:
+                await self.metrics_server.stop()
 
 
 # --- API端点(使用FastAPI风格) ---
 ai_service = AIService()
+request_pool = RecordPool(AIRequest, CONFIG["request_pool_size"])
 
 
-@lru_cache(maxsize=CONFIG["model_cache_size"])
 async def get_cached_model(model_name: str):
-    """带缓存的模型获取(减少模型加载开销)"""
-    return await ModelFactory.get_model(model_name)
+    """带缓存的模型获取(由ModelFactory模型池负责复用与淘汰)"""
+    return await ModelFactory.get_model(backend_key(model_name))
 
 
-async def ai_inference_endpoint(request_id: str, input_data: Any, model_name: str = "default"):
+async def ai_inference_endpoint(request_id: str, input_data: Any, model_name: str = "default",
+                                tenant: str = "default", priority: int = Priority.NORMAL):
     """API端点处理函数"""
-    # 创建请求对象
-    request = AIRequest(request_id=request_id, data=input_data)
+    # 创建请求对象(启用空闲链表时复用)
+    request = request_pool.acquire(request_id=request_id, data=input_data, tenant=tenant, priority=priority)
 
     # 处理请求
     response = await ai_service.process_request(request, model_name)
 
-    # 监控日志
-    logger.info(f"Processed request {request_id} in {response.latency:.4f}s")
+    # 超时或被取消的请求可能仍在批处理队列中，只回收已经结束的请求
+    if request.future is None or (request.future.done() and not request.future.cancelled()):
+        request_pool.release(request)
+
+    # 监控指标与抽样日志
+    counters, latency_metric = ai_service.request_metrics(model_name)
+    counters["error" if response.error else "ok"].inc()
+    latency_metric.observe(response.latency)
+    if should_log_request():
+        logger.info(f"Processed request {request_id} in {response.latency:.4f}s")
 
     return {
         "request_id": response.request_id,
         "result": response.result,
         "latency": response.latency,
-        "error": response.error
+        "error": response.error,
+        "cached": response.cached,
+        "similarity": response.similarity
     }
 
 
-# --- 测试模拟 ---
-async def simulate_clients(num_clients: int):
-    """模拟多个并发客户端请求"""
+async def ai_inference_stream_endpoint(request_id: str, input_data: Any, model_name: str = "default",
+                                       tenant: str = "default") -> AsyncGenerator[Dict[str, Any], None]:
+    """流式API端点处理函数(对应SSE/分块响应)，逐个产出分片，最后产出结束事件"""
+    request = AIRequest(request_id=request_id, data=input_data, tenant=tenant)
+    try:
+        async for chunk in ai_service.stream_request(request, model_name):
+            yield {"request_id": request_id, "chunk": chunk}
+    except AIRequestError as e:
+        yield {"request_id": request_id, "done": True, "error": str(e),
+               "latency": time.monotonic() - request.created_at}
+        return
+    yield {"request_id": request_id, "done": True, "error": None,
+           "latency": time.monotonic() - request.created_at}
+
+
+# --- 压测工具 ---
+def make_input_sampler(distribution: str, num_inputs: int, zipf_s: float,
+                       rng: random.Random) -> Callable[[int], str]:
+    """构造输入生成器，用于控制请求间的重复程度
+
+    uniform: 在num_inputs种输入中均匀抽取；zipf: 按排名的-s次幂抽取(热点集中)；
+    unique: 每个请求输入都不同(无重复)。
+    """
+    if distribution == "unique":
+        return lambda i: f"input_{i}"
+    if distribution == "zipf":
+        weights = [1 / (rank ** zipf_s) for rank in range(1, num_inputs + 1)]
+        cum_weights = []
+        total = 0.0
+        for weight in weights:
+            total += weight
+            cum_weights.append(total)
+        return lambda i: f"input_{bisect.bisect_left(cum_weights, rng.random() * total)}"
+    return lambda i: f"input_{rng.randrange(num_inputs)}"
+
+
+PARAPHRASE_TEMPLATES = ["please {}", "{}?", "could you {} please", "{}!", "can you do {} for me"]
+
+
+def make_paraphrase_sampler(sample: Callable[[int], str], rate: float,
+                            rng: random.Random) -> Callable[[int], str]:
+    """按rate比例把输入改写为措辞不同、含义相同的形式(精确缓存无法命中)"""
+    def paraphrase(i: int) -> str:
+        text = sample(i)
+        if rng.random() < rate:
+            text = rng.choice(PARAPHRASE_TEMPLATES).format(text)
+            if rng.random() < 0.5:
+                text = text.upper()
+        return text
+    return paraphrase
+
+
+def make_vector_sampler(sample: Callable[[int], str], dim: int) -> Callable[[int], List[float]]:
+    """把输入生成器映射为确定性的数值向量(相同输入得到相同向量)，用于tensor模式压测"""
+    def vector(i: int) -> List[float]:
+        rng = random.Random(sample(i))
+        return [rng.uniform(-1, 1) for _ in range(dim)]
+    return vector
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """最近秩法百分位数"""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(q * len(sorted_values) + 0.5) - 1))
+    return sorted_values[rank]
+
+
+def make_workload(sample: Callable[[int], str], tenants: int, bulk_fraction: float,
+                  rng: random.Random) -> Callable[[int], Dict[str, Any]]:
+    """构造第i个请求的参数：输入、租户与优先级
+
+    bulk_fraction>0时按该比例发送BULK请求，其余为INTERACTIVE，用于验证公平排队。
+    """
+    def workload(i: int) -> Dict[str, Any]:
+        if bulk_fraction > 0:
+            priority = Priority.BULK if rng.random() < bulk_fraction else Priority.INTERACTIVE
+        else:
+            priority = Priority.NORMAL
+        return {"input_data": sample(i), "tenant": f"tenant_{i % tenants}", "priority": priority}
+    return workload
+
+
+async def _timed_request(i: int, workload: Callable[[int], Dict[str, Any]],
+                         sent_at: float, model_name: str) -> Dict[str, Any]:
+    """发送一个请求，客户端延迟从计划发送时刻开始计算"""
+    params = workload(i)
+    res = await ai_inference_endpoint(f"req_{i}", model_name=model_name, **params)
+    res["client_latency"] = time.perf_counter() - sent_at
+    res["priority"] = priority_class(params["priority"])
+    return res
+
+
+async def run_closed_loop(num_requests: int, concurrency: int, workload: Callable[[int], Dict[str, Any]],
+                          model_name: str = "default") -> List[Dict[str, Any]]:
+    """闭环压测：concurrency个用户各自收到响应后立即发送下一个请求"""
+    results = []
+    counter = iter(range(num_requests))
+
+    async def user():
+        for i in counter:
+            results.append(await _timed_request(i, workload, time.perf_counter(), model_name))
+
+    await asyncio.gather(*(user() for _ in range(concurrency)))
+    return results
+
+
+async def run_open_loop(num_requests: int, rate: float, workload: Callable[[int], Dict[str, Any]],
+                        rng: random.Random, model_name: str = "default") -> List[Dict[str, Any]]:
+    """开环压测：按泊松过程以rate(请求/秒)到达，不受响应快慢影响
+
+    延迟从计划到达时刻算起，事件循环落后时的排队时间同样计入，避免协调遗漏。
+    """
     tasks = []
-    for i in range(num_clients):
-        request_id = f"req_{i}"
-        input_data = f"input_{i % 10}"  # 10种不同输入模式
-        tasks.append(ai_inference_endpoint(request_id, input_data))
+    next_arrival = time.perf_counter()
+    for i in range(num_requests):
+        next_arrival += rng.expovariate(rate)
+        delay = next_arrival - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(_timed_request(i, workload, next_arrival, model_name)))
     return await asyncio.gather(*tasks)
 
 
-async def main():
-    """主测试函数"""
+def build_report(args: argparse.Namespace, results: List[Dict[str, Any]], elapsed: float) -> Dict[str, Any]:
+    """汇总压测结果为JSON报告
+
+    延迟百分位只统计成功的请求(限流、队列满等快速失败会拉低延迟)，失败单独按原因计数。
+    """
+    succeeded = [res for res in results if not res.get("error")]
+    latencies = sorted(res["client_latency"] for res in succeeded)
+    errors = Counter(res["error"] for res in results if res.get("error"))
+    success = len(succeeded)
+    cache_hits = sum(1 for res in results if res.get("cached"))
+    by_class: Dict[str, List[float]] = {}
+    for res in succeeded:
+        by_class.setdefault(res["priority"], []).append(res["client_latency"])
+    for values in by_class.values():
+        values.sort()
+    return {
+        "mode": args.mode,
+        "distribution": args.distribution,
+        "requests": len(results),
+        "success": success,
+        "errors": dict(errors),
+        "error_rate": sum(errors.values()) / len(results) if results else 0.0,
+        "duration": elapsed,
+        "throughput": success / elapsed if elapsed else 0.0,
+        "latency": {
+            "mean": sum(latencies) / len(latencies) if latencies else 0.0,
+            "p50": percentile(latencies, 0.50),
+            "p90": percentile(latencies, 0.90),
+            "p99": percentile(latencies, 0.99),
+            "p999": percentile(latencies, 0.999),
+            "max": latencies[-1] if latencies else 0.0,
+        },
+        "latency_by_class": {
+            name: {"p50": percentile(values, 0.50), "p99": percentile(values, 0.99)}
+            for name, values in sorted(by_class.items())
+        },
+        "cache_hit_ratio": cache_hits / len(results) if results else 0.0,
+        "coalesced": ai_service.single_flight.coalesced,
+        "batch_size_histogram": ai_service.batch_size_histogram(),
+        "cache": ai_service.cache.stats(),
+        "semantic_cache": ai_service.semantic_stats(),
+        "queues": ai_service.queue_stats(),
+        "models": ModelFactory.stats(),
+        "request_pool": request_pool.stats(),
+    }
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="AI后端压测工具")
+    parser.add_argument("--mode", choices=["closed", "open"], default="closed",
+                        help="closed: 固定并发用户数; open: 泊松到达")
+    parser.add_argument("--requests", type=int, default=15, help="请求总数")
+    parser.add_argument("--concurrency", type=int, default=15, help="闭环模式的并发用户数")
+    parser.add_argument("--rate", type=float, default=100.0, help="开环模式的到达速率(请求/秒)")
+    parser.add_argument("--distribution", choices=["uniform", "zipf", "unique"], default="uniform",
+                        help="输入重复分布")
+    parser.add_argument("--inputs", type=int, default=10, help="不同输入的数量")
+    parser.add_argument("--zipf-s", type=float, default=1.1, help="zipf分布的指数")
+    parser.add_argument("--tenants", type=int, default=1, help="请求轮流使用的租户数")
+    parser.add_argument("--bulk-fraction", type=float, default=0.0,
+                        help="BULK请求的比例，>0时其余请求为INTERACTIVE")
+    parser.add_argument("--model", default="default", help="目标模型")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    parser.add_argument("--rate-limit", type=float,
+                        help="每个租户的限流速率(请求/秒，桶容量取相同值)，0关闭限流；默认使用CONFIG配置")
+    parser.add_argument("--output", help="把JSON报告写入该文件")
+    parser.add_argument("--execution", choices=["async", "process", "tensor"], default="async",
+                        help="目标模型的执行方式，process为进程池推理，tensor为数值批次零拷贝推理")
+    parser.add_argument("--vector-dim", type=int, default=384, help="tensor模式下输入向量的维度")
+    parser.add_argument("--metrics-port", type=int, help="在该端口导出Prometheus指标")
+    parser.add_argument("--log-sample-rate", type=float, help="单个请求日志的抽样比例")
+    parser.add_argument("--pool-size", type=int, help="AIRequest空闲链表容量，0表示不复用")
+    parser.add_argument("--semantic-cache", action="store_true", help="为目标模型开启语义缓存")
+    parser.add_argument("--semantic-threshold", type=float, help="语义缓存的相似度阈值")
+    parser.add_argument("--paraphrase", type=float, default=0.0,
+                        help="输入被改写(加客套词、标点、大小写)的比例，用于验证语义缓存")
+    return parser.parse_args(argv)
+
+
+async def main(argv: Optional[List[str]] = None):
+    """压测入口：按参数生成负载并输出JSON性能报告"""
+    args = parse_args(argv)
+    if args.metrics_port:
+        CONFIG["metrics_port"] = args.metrics_port
+    CONFIG["execution_modes"][args.model] = args.execution
+    if args.execution == "tensor":
+        CONFIG["tensor_models"][args.model] = {"input_dim": args.vector_dim, "output_dim": 16}
+    if args.log_sample_rate is not None:
+        CONFIG["request_log_sample_rate"] = args.log_sample_rate
+    if args.pool_size is not None:
+        request_pool.max_size = args.pool_size
+    if args.rate_limit is not None:
+        ai_service.rate_limiter = None if args.rate_limit <= 0 else RateLimiter(
+            capacity=max(1.0, args.rate_limit), refill_rate=args.rate_limit, quotas=CONFIG["tenant_quotas"])
+    if args.semantic_cache:
+        options = {} if args.semantic_threshold is None else {"threshold": args.semantic_threshold}
+        ai_service.semantic_caches[args.model] = SemanticCache(args.model, **options)
+    rng = random.Random(args.seed)
+    sample = make_input_sampler(args.distribution, args.inputs, args.zipf_s, rng)
+    if args.paraphrase > 0:
+        sample = make_paraphrase_sampler(sample, args.paraphrase, rng)
+    if args.execution == "tensor":
+        sample = make_vector_sampler(sample, args.vector_dim)
+    workload = make_workload(sample, args.tenants, args.bulk_fraction, rng)
+
     # 启动服务生命周期
     async with ai_service.lifespan():
-        # 模拟客户端请求
-        start_time = time.time()
-        results = await simulate_clients(15) # 原100
-        elapsed = time.time() - start_time
-
-        # 分析结果
-        success = sum(1 for res in results if not res.get('error'))
-        cache_hits = sum(1 for res in results if res.get('latency', 0) < 0.01)
-        avg_latency = sum(res.get('latency', 0) for res in results) / len(results)
+        gc_before = [gen["collections"] for gen in gc.get_stats()]
+        start_time = time.perf_counter()
+        if args.mode == "open":
+            results = await run_open_loop(args.requests, args.rate, workload, rng, args.model)
+        else:
+            results = await run_closed_loop(args.requests, args.concurrency, workload, args.model)
+        elapsed = time.perf_counter() - start_time
+        report = build_report(args, results, elapsed)
+        # 压测期间各代GC的回收次数，用于衡量分配压力
+        report["gc_collections"] = [gen["collections"] - before
+                                    for gen, before in zip(gc.get_stats(), gc_before)]
 
-        print(f"\n=== 性能报告 ===")
-        print(f"总请求数: {len(results)}")
-        print(f"成功请求: {success} ({success / len(results) * 100:.1f}%)")
-        print(f"缓存命中: {cache_hits}")
-        print(f"平均延迟: {avg_latency:.4f}s")
-        print(f"总处理时间: {elapsed:.4f}s")
-        print(f"吞吐量: {len(results) / elapsed:.2f} req/s")
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
 
 
 # 运行测试
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
@@ -0,0 +1,36 @@
+import importlib.util
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_module(name, path):
+    """按路径加载演示脚本(文件名含连字符或中文，不能直接import)，每次得到全新的模块状态"""
+    spec = importlib.util.spec_from_file_location(name, os.path.join(ROOT, path))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def backend(tmp_path, monkeypatch):
+    """asyncioModule/AI-backend-async-demo.py，日志与缓存文件写入临时目录"""
+    monkeypatch.chdir(tmp_path)
+    module = load_module("ai_backend_demo", "asyncioModule/AI-backend-async-demo.py")
+    module.ai_service.rate_limiter = None
+    yield module
+    sys.modules.pop("ai_backend_demo", None)
+
+
+@pytest.fixture
+def flyweight(tmp_path):
+    """ai_design_mode/享元模式AI模型共享.py，权重文件写入临时目录且不模拟下载耗时"""
+    module = load_module("flyweight_demo", "ai_design_mode/享元模式AI模型共享.py")
+    module.weights_store = module.WeightsStore(str(tmp_path))
+    module.LOAD_SECONDS_PER_MB = 0
+    yield module
+    sys.modules.pop("flyweight_demo", None)
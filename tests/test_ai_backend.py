@@ -0,0 +1,363 @@
+import asyncio
+
+import pytest
+
+
+def use_tensor_model(backend, dim=8):
+    backend.CONFIG.update(
+        execution_modes={"default": "tensor"},
+        tensor_models={"default": {"input_dim": dim, "output_dim": 4}},
+        process_pool_workers=1,
+        process_start_method="fork",  # 测试按路径加载模块，spawn的worker无法按模块名重新导入
+        preload_models=[],
+    )
+
+
+@pytest.mark.parametrize("with_numpy", [True, False])
+def test_tensor_results_are_plain_lists_and_cacheable(backend, with_numpy):
+    if with_numpy:
+        pytest.importorskip("numpy")
+    else:
+        backend.np = None
+    use_tensor_model(backend)
+    service = backend.ai_service
+    vector = [0.1] * 8
+
+    async def run():
+        async with service.lifespan():
+            first = await service.process_request(backend.AIRequest("a", vector))
+            second = await service.process_request(backend.AIRequest("b", vector))
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert first.error is None and not first.cached
+    assert type(first.result) is list and all(type(x) is float for x in first.result)
+    assert second.error is None and second.cached
+    assert second.result == first.result
+
+
+def count_predict_calls(backend, monkeypatch):
+    calls = []
+    original = backend.AIModelAdapter.predict
+
+    async def predict(self, inputs):
+        calls.append(len(inputs))
+        return await original(self, inputs)
+
+    monkeypatch.setattr(backend.AIModelAdapter, "predict", predict)
+    return calls
+
+
+def test_batch_of_only_cancelled_requests_skips_model(backend, monkeypatch):
+    calls = count_predict_calls(backend, monkeypatch)
+
+    async def run():
+        processor = backend.BatchProcessor("default")
+        await processor.start_processing()
+        request = backend.AIRequest("a", "x")
+        await processor.add_request(request)
+        request.cancel()
+        await asyncio.sleep(backend.CONFIG["max_batch_time"] * 3)
+        state = processor.breaker.state
+        await processor.drain(backend.time.monotonic())
+        return processor, state
+
+    processor, state = asyncio.run(run())
+    assert calls == []
+    assert not processor.batch_sizes
+    assert processor.queue.cancelled == 1
+    assert state is backend.CircuitState.CLOSED
+
+
+def test_identical_requests_share_one_model_call(backend, monkeypatch):
+    calls = count_predict_calls(backend, monkeypatch)
+    service = backend.ai_service
+
+    async def run():
+        return await asyncio.gather(*(service.process_request(backend.AIRequest(f"r{i}", "same"))
+                                      for i in range(10)))
+
+    responses = asyncio.run(run())
+    assert calls == [1]
+    assert all(r.error is None for r in responses)
+    assert len({r.result for r in responses}) == 1
+    assert service.single_flight.coalesced == 9
+
+
+def test_follower_cancel_keeps_leader_running(backend, monkeypatch):
+    calls = count_predict_calls(backend, monkeypatch)
+    service = backend.ai_service
+
+    async def run():
+        leader = asyncio.create_task(service.process_request(backend.AIRequest("a", "x")))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(service.process_request(backend.AIRequest("b", "x")))
+        await asyncio.sleep(0.01)
+        follower.cancel()
+        return await leader
+
+    response = asyncio.run(run())
+    assert response.error is None
+    assert calls == [1]
+
+
+def test_all_waiters_cancelled_discards_request(backend, monkeypatch):
+    calls = count_predict_calls(backend, monkeypatch)
+    service = backend.ai_service
+
+    async def run():
+        tasks = [asyncio.create_task(service.process_request(backend.AIRequest(f"r{i}", "x"))) for i in range(3)]
+        await asyncio.sleep(0.01)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await asyncio.sleep(backend.CONFIG["max_batch_time"] * 3)
+
+    asyncio.run(run())
+    assert calls == []
+    assert not service.single_flight.calls
+
+
+def test_join_never_returns_a_finished_future(backend):
+    async def run():
+        flight = backend.SingleFlight()
+        abandoned = backend.AIRequest("a", "x")
+        abandoned.attach_future()
+        flight.register("k", abandoned)
+        flight.leave("k")
+        # 完成回调尚未执行，新请求也不能合并到已取消的Future上
+        after_cancel = flight.join("k")
+
+        finished = backend.AIRequest("b", "y")
+        finished.attach_future()
+        flight.register("j", finished)
+        finished.future.set_result(None)
+        after_result = flight.join("j")
+        return abandoned, after_cancel, after_result
+
+    abandoned, after_cancel, after_result = asyncio.run(run())
+    assert abandoned.cancelled
+    assert after_cancel is None
+    assert after_result is None
+
+
+def test_breaker_opens_on_failure_rate_and_rejects_during_cooldown(backend):
+    breaker = backend.CircuitBreaker("m", min_calls=4, cooldown=60.0)
+    for ok in (True, False, True, False):
+        breaker.record(ok, permit=breaker.allow())
+    assert breaker.state is backend.CircuitState.OPEN
+    assert breaker.allow() is None
+    assert not breaker.available()
+
+
+def open_breaker(backend, **kwargs):
+    breaker = backend.CircuitBreaker("m", cooldown=0.0, **kwargs)
+    breaker.trip("test")
+    return breaker
+
+
+def test_breaker_half_open_admits_one_trial(backend):
+    breaker = open_breaker(backend)
+    trial = breaker.allow()
+    assert trial and breaker.state is backend.CircuitState.HALF_OPEN
+    assert breaker.allow() is None
+    assert not breaker.available()
+
+
+def test_breaker_ignores_outcomes_of_calls_admitted_before_trip(backend):
+    breaker = backend.CircuitBreaker("m", cooldown=0.0)
+    stale = breaker.allow()
+    breaker.trip("test")
+    trial = breaker.allow()
+    breaker.record(True, permit=stale)
+    breaker.release_trial(stale)
+    assert breaker.state is backend.CircuitState.HALF_OPEN
+    breaker.record(True, permit=trial)
+    assert breaker.state is backend.CircuitState.CLOSED
+
+
+@pytest.mark.parametrize("ok, latency", [(False, 0.0), (True, 5.0)])
+def test_breaker_failed_or_slow_trial_reopens(backend, ok, latency):
+    breaker = open_breaker(backend, slow_call_latency=1.0)
+    trial = breaker.allow()
+    breaker.record(ok, latency, permit=trial)
+    assert breaker.state is backend.CircuitState.OPEN
+    assert breaker.trips == 2
+
+
+def test_breaker_trial_released_without_outcome_reopens(backend):
+    breaker = open_breaker(backend)
+    trial = breaker.allow()
+    breaker.release_trial(trial)
+    assert breaker.state is backend.CircuitState.OPEN
+    breaker.release_trial(trial)
+    assert breaker.trips == 2
+
+
+def test_breaker_lost_trial_times_out(backend):
+    breaker = open_breaker(backend, trial_timeout=0.0)
+    first = breaker.allow()
+    second = breaker.allow()
+    assert second and second != first
+    breaker.record(True, permit=first)
+    assert breaker.state is backend.CircuitState.HALF_OPEN
+    breaker.record(True, permit=second)
+    assert breaker.state is backend.CircuitState.CLOSED
+
+
+class SlowModel:
+    def __init__(self):
+        self.cancelled = 0
+
+    async def predict(self, inputs):
+        try:
+            await asyncio.sleep(60)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+
+
+def hedged_processor(backend, backup):
+    backend.CONFIG.update(hedge_enabled=True, hedge_min_samples=0)
+    processor = backend.BatchProcessor("default")
+    processor.sizer.percentile = lambda q: 0.01
+    processor.dispatcher = type("Dispatcher", (), {"hedge_target": lambda self, primary: backup})()
+    return processor
+
+
+def test_hedge_tasks_are_cancelled_with_caller(backend):
+    primary, secondary = SlowModel(), SlowModel()
+    backup = type("Backup", (), {"hedge_predict": lambda self, inputs: secondary.predict(inputs)})()
+
+    async def run():
+        processor = hedged_processor(backend, backup)
+        task = asyncio.ensure_future(processor._predict(primary, ["x"]))
+        await asyncio.sleep(0.05)
+        assert processor.hedged == 1
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert primary.cancelled == 1 and secondary.cancelled == 1
+
+    asyncio.run(run())
+
+
+def test_hedge_winner_cancels_primary(backend):
+    primary = SlowModel()
+
+    async def fast(inputs):
+        return ["backup"]
+
+    backup = type("Backup", (), {"hedge_predict": lambda self, inputs: fast(inputs)})()
+
+    async def run():
+        processor = hedged_processor(backend, backup)
+        result = await processor._predict(primary, ["x"])
+        assert result == ["backup"] and processor.hedge_wins == 1
+        assert primary.cancelled == 1
+
+    asyncio.run(run())
+
+
+def test_sqlite_cache_errors_are_misses(backend, tmp_path):
+    path = tmp_path / "cache.db"
+    path.write_bytes(b"not a database" * 100)
+
+    async def run():
+        cache = backend.SQLiteCacheBackend(str(path))
+        await cache.set("k", "v")
+        value = await cache.get("k")
+        await cache.close()
+        return cache, value
+
+    cache, value = asyncio.run(run())
+    assert value is None
+    assert cache.stats()["errors"] == 2
+
+
+def test_sqlite_cache_round_trip(backend, tmp_path):
+    async def run():
+        cache = backend.SQLiteCacheBackend(str(tmp_path / "cache.db"))
+        await cache.set("k", {"result": [1.0]})
+        value = await cache.get("k")
+        await cache.close()
+        return value
+
+    assert asyncio.run(run()) == {"result": [1.0]}
+
+
+def test_rate_limiter_keeps_in_debt_buckets_when_evicting(backend):
+    limiter = backend.RateLimiter(capacity=1, refill_rate=0.001, max_keys=2)
+    assert limiter.try_acquire("a")
+    limiter._bucket("idle", backend.time.monotonic())
+    assert limiter.try_acquire("b")
+    assert "idle" not in limiter.buckets
+    assert limiter.try_acquire("c")
+    assert list(limiter.buckets) == ["a", "b", "c"]
+    assert not limiter.try_acquire("a")
+
+
+@pytest.mark.parametrize("mode, verified", [(None, 0), ("process", 1)])
+def test_semantic_hits_are_verified_only_for_deterministic_models(backend, mode, verified):
+    backend.CONFIG.update(process_pool_workers=1, process_start_method="fork",
+                          cpu_model_work_rounds=1, preload_models=[])
+    if mode:
+        backend.CONFIG["execution_modes"]["default"] = mode
+    service = backend.ai_service
+    semantic = backend.SemanticCache("default", verify_rate=1.0)
+    service.semantic_caches = {"default": semantic}
+
+    async def run():
+        async with service.lifespan():
+            await service.process_request(backend.AIRequest("a", "tell me a joke"))
+            service.cache = backend.PredictionCache()  # 清空精确缓存，下一次走语义缓存
+            hit = await service.process_request(backend.AIRequest("b", "tell me a joke"))
+            while service._background:
+                await asyncio.sleep(0.01)
+        return hit
+
+    hit = asyncio.run(run())
+    assert hit.cached
+    stats = service.semantic_stats()["default"]
+    assert stats["verify"] is bool(mode)
+    assert stats["verified"] == verified and stats["false_hits"] == 0
+
+
+def test_steady_state_requests_do_not_look_up_metrics(backend, monkeypatch):
+    backend.CONFIG["preload_models"] = []
+    service = backend.ai_service
+    lookups = []
+    original = backend.metrics._get
+
+    async def run():
+        async with service.lifespan():
+            await backend.ai_inference_endpoint("warmup", "x")
+            monkeypatch.setattr(backend.metrics, "_get", lambda *args: lookups.append(args[1]) or original(*args))
+            await asyncio.gather(*(backend.ai_inference_endpoint(f"r{i}", f"x{i}",
+                                                                 priority=backend.Priority(i % 3))
+                                   for i in range(20)))
+
+    asyncio.run(run())
+    assert lookups == []
+
+
+def test_dedicated_replicas_do_not_evict_each_other(backend, monkeypatch):
+    backend.CONFIG.update(replica_backends={"default": "dedicated"}, replicas={"default": 3},
+                          model_memory_budget_mb=10 ** 6)
+    unloaded = []
+
+    async def unload(self):
+        unloaded.append(self.model_name)
+
+    monkeypatch.setattr(backend.AIModelAdapter, "unload", unload)
+    factory = backend.ModelFactory
+
+    async def run():
+        await factory.preload(["default"])
+        assert sorted(factory._models) == ["default#0", "default#1", "default#2"]
+        await factory.get_model("other")
+        await factory.get_model("third")
+        return sorted(factory._models)
+
+    assert asyncio.run(run()) == ["other", "third"]
+    assert unloaded == ["default"] * 3
@@ -0,0 +1,62 @@
+import random
+import threading
+import time
+
+
+def test_variants_share_base_weights(flyweight):
+    factory = flyweight.ModelFactory
+    with factory.lease(flyweight.ModelKey("BERT", "v1", False)) as full:
+        with factory.lease(flyweight.ModelKey("BERT", "v1", True)) as quantized:
+            assert full.base is quantized.base
+            assert factory.used_mb() == 420 + 8
+
+
+def test_leased_model_is_not_evicted(flyweight):
+    factory = flyweight.ModelFactory
+    factory.configure(memory_budget_mb=500, load_timeout=0.2)
+    with factory.lease(flyweight.ModelKey("BERT", "v1", False)):
+        try:
+            with factory.lease(flyweight.ModelKey("BERT", "v2", False)):
+                pass
+        except MemoryError:
+            pass
+        else:
+            raise AssertionError("loading past the budget must wait and then fail")
+    assert factory.stats()["loading"] == 0
+    # 归还后可以卸载旧版本腾出空间
+    with factory.lease(flyweight.ModelKey("BERT", "v2", False)):
+        assert factory.stats()["evictions"] == 1
+
+
+def test_concurrent_leases_under_budget(flyweight):
+    factory = flyweight.ModelFactory
+    factory.configure(memory_budget_mb=900, load_timeout=10)
+    keys = [flyweight.ModelKey(name, version, quantized)
+            for name in ("BERT", "ResNet50") for version in ("v1", "v2", "v3") for quantized in (False, True)]
+    errors = []
+
+    def worker(seed):
+        rng = random.Random(seed)
+        for _ in range(40):
+            try:
+                with factory.lease(rng.choice(keys)) as model:
+                    assert not model.weights.obj.closed
+            except Exception as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(seed,), daemon=True) for seed in range(16)]
+    for thread in threads:
+        thread.start()
+    deadline = time.time() + 60
+    for thread in threads:
+        thread.join(timeout=max(0.0, deadline - time.time()))
+    assert not any(thread.is_alive() for thread in threads), "lease deadlocked"
+    assert errors == []
+
+    with factory._lock:
+        assert not factory._loading and not factory._reserved and not factory._pending_users
+        assert factory.used_mb() <= 900
+        for (name, version), base in factory._bases.items():
+            users = [m for k, m in factory._models.items() if (k.model_name, k.model_version) == (name, version)]
+            assert base.users == len(users)
+            assert all(m.base is base for m in users)